@@ -0,0 +1,196 @@
+#!/usr/bin/python2
+# encoding: utf-8
+"""Synthetic launch histories, and timings of the Database and renderers on them.
+
+Each benchmark is written as one JSON object per line, so runs can be
+appended to a file and compared across versions of ek.py."""
+from ek import *
+from datetime import date
+import bisect
+import json
+import random
+import resource
+import sys
+import time
+
+DESTINATIONS = sorted((d for d in globals().values() if isinstance(d, Destination)), key=lambda d: d.sort)
+# rough share of launches going to each (by abbreviation); the rest spread evenly
+DESTINATION_WEIGHTS = {'LEO': 40, 'SO': 10, 'GEO': 8, 'EO': 5, 'SSO': 5, 'MEO': 3, 'HEO': 3, 'EA': 3, 'LO': 2, 'LF': 2}
+
+def synthdb(launches, seed=0, families=None, depth=4, fanout=3, table=True):
+    """Build a Database of made-up launches.
+
+    There are `families` trees (by default, about one per thousand launches)
+    of each of engines, stages and LVs, each `depth` levels deep with up to
+    `fanout` children per node.  Launches are spread over the years from
+    1950 at about two a day, on LVs chosen with a long-tailed popularity, and
+    mostly succeed; failures name a stage of the LV, and occasionally one
+    or two higher ones as well.  With table set, launches are stored in a
+    LaunchTable."""
+    rng = random.Random(seed)
+    if families is None:
+        families = max(2, launches // 1000)
+    def tree(make_root, make_child, prefix):
+        # [(root, [descendants])]; every other family is for vacuum use
+        trees = []
+        for f in xrange(families):
+            root = make_root('%s%d' % (prefix, f), f % 2 == 1)
+            nodes = []
+            level = [root]
+            for d in xrange(depth):
+                children = []
+                for node in level:
+                    for c in xrange(rng.randint(1, fanout)):
+                        children.append(make_child('%s.%d' % (node.name, c), node, root, d == depth - 1))
+                level = children
+                nodes.extend(children)
+            trees.append((root, nodes))
+        return trees
+    # a stage family is built around an engine family, and its final versions
+    # use particular engines from it
+    engines = tree(lambda name, vac: EngineFamily(name, "Synthetic engine family.", vac),
+                   lambda name, family, root, leaf: Engine(name, family), 'E')
+    engine_families = dict((vac, [root for root, nodes in engines if root.vac == vac]) for vac in (False, True))
+    engines = dict(engines)
+    stages = tree(lambda name, vac: StageFamily(name, rng.choice(engine_families[vac]), "Synthetic stage family.", rng.randint(1, 4), vac),
+                  lambda name, family, root, leaf: Stage(name, family, rng.choice(engines[root.engine]) if leaf else None), 'S')
+    booster_stages = [stage for root, nodes in stages if not root.vac for stage in nodes]
+    upper_stages = [stage for root, nodes in stages if root.vac for stage in nodes]
+    def lv(name, family, root, leaf):
+        uppers = rng.sample(upper_stages, rng.randint(0, min(3, len(upper_stages))))
+        return LV(name, family, None, rng.choice(booster_stages), *uppers)
+    lvs = [vehicle for root, nodes in tree(lambda name, vac: LVFamily(name, "Synthetic launch vehicle family."), lv, 'L') for vehicle in nodes]
+    def cumulate(weights):
+        totals = []
+        for w in weights:
+            totals.append(w + (totals[-1] if totals else 0))
+        return totals
+    cumulative = cumulate(rng.paretovariate(1.2) for l in lvs)
+    dest_cumulative = cumulate(DESTINATION_WEIGHTS.get(d.abbr, 1) for d in DESTINATIONS)
+    def pick(items, cumulative):
+        return items[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+    def result(vehicle):
+        r = rng.random()
+        if r < 0.85:
+            return 0
+        if r < 0.87:
+            return -2
+        if r < 0.90:
+            return -1
+        failed = rng.randint(1, len(vehicle.stages))
+        higher = range(failed + 1, len(vehicle.stages) + 1)
+        if r < 0.99 or not higher:
+            return failed
+        # each of the further failing stages fails once, as a stage's engines
+        # can only fail as many times as it has them
+        return (failed,) + tuple(sorted(rng.sample(higher, min(rng.randint(1, 2), len(higher)))))
+    history = LaunchTable() if table else []
+    day = date(1950, 1, 1).toordinal()
+    for i in xrange(launches):
+        day += rng.randint(0, 1)
+        vehicle = pick(lvs, cumulative)
+        payload = Payload("Synthetic %d" % (i,)) if rng.random() < 0.7 else Payload(None, paren="%d kg ballast" % (rng.randint(1, 20) * 100,))
+        args = ("Launch %d" % (i,), date.fromordinal(day), vehicle, payload, pick(DESTINATIONS, dest_cumulative), result(vehicle))
+        if table:
+            history.append(history.add(*args))
+        else:
+            history.append(Launch(*args))
+    return Database(history)
+
+def peak_rss():
+    """High-water mark of this process's memory use so far, in KiB.
+
+    This never goes down, so it covers every benchmark run before the current
+    one (and the history they ran on) too."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def timed(func, repeat):
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return times
+
+def benchmarks(db, seed=0):
+    """(name, function) pairs for the hot paths, run against db."""
+    rng = random.Random(seed)
+    text = TextRenderer(db)
+    html = HtmlRenderer(db)
+    years = sorted(db.launches_by_year)
+    busiest = max(years, key=lambda y: len(db.launches_by_year[y]))
+    busiest_lv = max(sorted(db.lvs), key=lambda name: len(db.filter_launches(lv=name)))
+    lvs = rng.sample(sorted(db.lvs), min(20, len(db.lvs)))
+    stages = rng.sample(sorted(db.stages), min(20, len(db.stages)))
+    engines = rng.sample(sorted(db.engines), min(20, len(db.engines)))
+    def roll_ups():
+        db._changed()
+        db.lv_families, db.stage_families, db.engine_families
+    def coalesce():
+        for items in (db.lvs.values(), db.stages.values(), db.engines.values()):
+            for maxdepth in (1, 2, 3):
+                db.coalesce_dests(items, maxdepth)
+    def filters():
+        for name in lvs:
+            db.filter_launches(lv=name)
+            db.filter_launches(lv=name, year=busiest)
+        for name in stages:
+            db.filter_launches(stage=name, limit=50)
+        for name in engines:
+            db.filter_launches(engine=name, offset=10, limit=50)
+    rows = [{'name': l.name, 'date': l.date, 'lv': l.lv.name, 'dest': l.dest.abbr} for l in db.launches[:10000]]
+    cols = [{'head': 'Name', 'key': 'name'}, {'head': 'Date', 'key': 'date', 'formatter': date.isoformat},
+            {'head': 'LV', 'key': 'lv'}, {'head': 'Destination', 'key': 'dest'}]
+    return [
+        ('Database.update', db.update),
+        ('Database.roll_ups', roll_ups),
+        ('Database.coalesce_dests', coalesce),
+        ('Database.filter_launches', filters),
+        ('TextRenderer.table', lambda: text.table([dict(c) for c in cols], rows)),
+        ('TextRenderer.table, declared widths', lambda: text.table([dict(c, width=12) for c in cols], rows)),
+        ('TextRenderer.render_launches_per_year', lambda: text.render_launches_per_year(2)),
+        ('TextRenderer.render_lv_families', lambda: text.render_lv_families(2, 1)),
+        ('TextRenderer.render_stage_families', lambda: text.render_stage_families(2, 1)),
+        ('TextRenderer.render_engine_families', lambda: text.render_engine_families(2, 1)),
+        ('HtmlRenderer.render_index', html.render_index),
+        ('HtmlRenderer.render_launches_per_year', lambda: html.render_launches_per_year(2)),
+        ('HtmlRenderer.render_lv_families', lambda: html.render_lv_families(2, 1)),
+        ('HtmlRenderer.render_stage_families', lambda: html.render_stage_families(2, 1)),
+        ('HtmlRenderer.render_engine_families', lambda: html.render_engine_families(2, 1)),
+        ('HtmlRenderer.launches_for_year', lambda: html.launches_for_year(busiest)),
+        ('HtmlRenderer.render_lv_info', lambda: html.render_lv_info(busiest_lv)),
+    ]
+
+def run(sizes, seed=0, repeat=3, match=None, out=sys.stdout):
+    version = source_checksum()
+    for n in sizes:
+        def record(name, times, before):
+            # process_peak_rss_kb is the peak so far; only the growth in it is
+            # down to this benchmark alone
+            peak = peak_rss()
+            out.write(json.dumps({'benchmark': name, 'launches': n, 'seed': seed, 'ek': version,
+                                  'best': min(times), 'mean': sum(times) / len(times), 'repeat': len(times),
+                                  'process_peak_rss_kb': peak, 'peak_rss_growth_kb': peak - before}, sort_keys=True) + '\n')
+            out.flush()
+        before = peak_rss()
+        start = time.time()
+        db = synthdb(n, seed)
+        record('synthdb', [time.time() - start], before)
+        for name, func in benchmarks(db, seed):
+            if match is None or match in name:
+                before = peak_rss()
+                record(name, timed(func, repeat), before)
+
+if __name__ == '__main__':
+    import optparse
+    x = optparse.OptionParser(usage='%prog [options]', description=__doc__.split('\n')[0])
+    x.add_option('-n', '--launches', type='int', action='append', help='Size of history to generate (may be repeated; default 1000 and 10000)')
+    x.add_option('-s', '--seed', type='int', default=0, help='Seed for the generator')
+    x.add_option('-r', '--repeat', type='int', default=3, help='Number of times to run each benchmark')
+    x.add_option('-k', '--match', help='Only run benchmarks whose name contains MATCH')
+    x.add_option('-o', '--output', metavar='FILE', help='Append results to FILE rather than printing them')
+    opts, args = x.parse_args()
+    if args:
+        x.error("Unexpected positional arguments")
+    out = open(opts.output, 'a') if opts.output else sys.stdout
+    run(opts.launches or [1000, 10000], opts.seed, opts.repeat, opts.match, out)
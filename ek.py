@@ -5,13 +5,101 @@
 Launch library and vehicle/stage/engine database."""
 
 from datetime import date
-from nevow import tags as t
-from nevow.flat import flatten
-import nevow.entities
-import urllib
+import array
+import bisect
+import collections
+import cPickle
+import gc
+import hashlib
+import importlib
+import itertools
+import math
+import mmap
+import os
+import re
+import time
 
-class EngineFamily(object):
+class _LazyModule(object):
+    """Stand-in for a module, which is imported on first use.
+
+    The HTML and web stack (nevow pulls in Twisted) is slow to import, and
+    text-only users of the Database never need it."""
+    def __init__(self, name):
+        self.__name = name
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name)
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+t = _LazyModule('nevow.tags')
+entities = _LazyModule('nevow.entities')
+urllib = _LazyModule('urllib')
+
+def flatten(stan):
+    from nevow.flat import flatten
+    return flatten(stan)
+
+def source_checksum(fn=__file__):
+    """SHA-1 of a Python source file (by default, this module)."""
+    if fn.endswith('.pyc'):
+        fn = fn[:-1]
+    with open(fn, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class Catalogued(object):
+    """Base for catalogue classes whose attributes default to their family's.
+
+    Each attribute named in _inherited is kept twice: the value as given, in
+    a slot with a leading underscore, and the resolved value (falling back to
+    the family) in a plain slot.  Reads are then ordinary slot lookups; any
+    assignment re-resolves the entry and everything that inherits from it."""
+    __slots__ = ('_members',)
+    _inherited = ()
+    def __init__(self):
+        object.__setattr__(self, '_members', [])
+    def __setattr__(self, attr, value):
+        if attr in self._inherited:
+            attr = '_' + attr
+        elif attr == 'family':
+            old = getattr(self, 'family', None)
+            if old is not None:
+                old._members.remove(self)
+            if value is not None:
+                value._members.append(self)
+        object.__setattr__(self, attr, value)
+        self._resolve()
+    def _inherit(self, attr, own):
+        family = getattr(self, 'family', None)
+        if own is None and family is not None:
+            return getattr(family, attr, None)
+        return own
+    def __getstate__(self):
+        # Only the values as given; resolved values and members are rebuilt
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if slot != '_members' and slot not in self._inherited and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+    def __setstate__(self, state):
+        object.__setattr__(self, '_members', [])
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
+        family = getattr(self, 'family', None)
+        if family is not None:
+            family._members.append(self)
+        self._resolve()
+    def _resolve(self):
+        for attr in self._inherited:
+            object.__setattr__(self, attr, self._inherit(attr, getattr(self, '_' + attr, None)))
+        for member in self._members:
+            member._resolve()
+
+class EngineFamily(Catalogued):
+    __slots__ = ('name', 'description', '_description', 'vac', '_vac', 'family')
+    _inherited = ('description', 'vac')
     def __init__(self, name, description, vac=False):
+        super(EngineFamily, self).__init__()
         self.name = name
         self.description = description
         self.vac = vac
@@ -20,34 +108,24 @@ class EngineFamily(object):
         return self.name
     __repr__ = __str__ # XXX naughty temporary hack for testing
 
-class Engine(object):
+class Engine(Catalogued):
+    __slots__ = ('name', 'description', '_description', 'vac', '_vac', 'family')
+    _inherited = ('description', 'vac')
     def __init__(self, name, family, description=None, vac=None):
+        super(Engine, self).__init__()
         self.name = name
         self.family = family
-        self._description = description
-        self._vac = vac
-    @property
-    def description(self):
-        if self._description is None and self.family is not None:
-            return self.family.description
-        return self._description
-    @description.setter
-    def description(self, value):
-        self._description = value
-    @property
-    def vac(self):
-        if self._vac is None and self.family is not None:
-            return self.family.vac
-        return self._vac
-    @vac.setter
-    def vac(self, value):
-        self._vac = value
+        self.description = description
+        self.vac = vac
     def __str__(self):
         return self.name
     __repr__ = __str__ # XXX naughty
 
-class StageFamily(object):
+class StageFamily(Catalogued):
+    __slots__ = ('name', 'engine', '_engine', 'description', '_description', 'engine_count', '_engine_count', 'vac', '_vac', 'family')
+    _inherited = ('engine', 'description', 'engine_count', 'vac')
     def __init__(self, name, ef, description, engine_count=1, vac=False):
+        super(StageFamily, self).__init__()
         self.name = name
         self.engine = ef
         self.description = description
@@ -58,52 +136,26 @@ class StageFamily(object):
         return self.name
     __repr__ = __str__ # XXX naughty
 
-class Stage(object):
+class Stage(Catalogued):
+    __slots__ = ('name', 'engine', '_engine', 'description', '_description', 'engine_count', '_engine_count', 'vac', '_vac', 'family')
+    _inherited = ('engine', 'description', 'engine_count', 'vac')
     def __init__(self, name, family, engine=None, description=None, engine_count=None, vac=None):
+        super(Stage, self).__init__()
         self.name = name
         self.family = family
-        self._engine = engine
-        self._description = description
-        self._engine_count = engine_count
-        self._vac = vac
-    @property
-    def engine(self):
-        if self._engine is None and self.family is not None:
-            return self.family.engine
-        return self._engine
-    @engine.setter
-    def engine(self, value):
-        self._engine = value
-    @property
-    def description(self):
-        if self._description is None and self.family is not None:
-            return self.family.description
-        return self._description
-    @description.setter
-    def description(self, value):
-        self._description = value
-    @property
-    def engine_count(self):
-        if self._engine_count is None and self.family is not None:
-            return self.family.engine_count
-        return self._engine_count
-    @engine_count.setter
-    def engine_count(self, value):
-        self._engine_count = value
-    @property
-    def vac(self):
-        if self._vac is None and self.family is not None:
-            return self.family.vac
-        return self._vac
-    @vac.setter
-    def vac(self, value):
-        self._vac = value
+        self.engine = engine
+        self.description = description
+        self.engine_count = engine_count
+        self.vac = vac
     def __str__(self):
         return self.name
     __repr__ = __str__ # XXX naughty
 
-class LVFamily(object):
+class LVFamily(Catalogued):
+    __slots__ = ('name', 'description', '_description', 'stages', '_stages', 'family')
+    _inherited = ('description', 'stages')
     def __init__(self, name, description, *sf):
+        super(LVFamily, self).__init__()
         self.name = name
         self.description = description
         self.stages = sf
@@ -112,28 +164,23 @@ class LVFamily(object):
         return self.name
     __repr__ = __str__ # XXX naughty
 
-class LV(object):
+class LV(Catalogued):
+    __slots__ = ('name', 'description', '_description', 'stages', '_stages', 'family')
+    _inherited = ('description', 'stages')
     def __init__(self, name, family, description=None, *stages):
+        super(LV, self).__init__()
         self.name = name
         self.family = family
-        self._description = description
-        self._stages = stages
-    @property
-    def stages(self):
-        if not self._stages and self.family is not None:
-            return self.family.stages
-        return self._stages
-    @stages.setter
-    def stages(self, value):
-        self._stages = value
-    @property
-    def description(self):
-        if self._description is None and self.family is not None:
-            return self.family.description
-        return self._description
-    @description.setter
-    def description(self, value):
-        self._description = value
+        self.description = description
+        self.stages = stages
+    def _inherit(self, attr, own):
+        if attr == 'stages':
+            # an empty stage list also means "same as family"
+            family = getattr(self, 'family', None)
+            if not own and family is not None:
+                return family.stages
+            return own
+        return super(LV, self)._inherit(attr, own)
     def __str__(self):
         return self.name
     __repr__ = __str__ # XXX naughty
@@ -144,25 +191,49 @@ class Destination(object):
         self.name = name
         self.abbr = abbr
         self.description = description
-        self.category = category
         global _destination_sort
         self.sort = _destination_sort
         _destination_sort += 1
         self._depth = 0
+        self._category = None
+        self.children = []
+        self.category = category
+    @property
+    def category(self):
+        return self._category
+    @category.setter
+    def category(self, value):
+        if self._category is not None:
+            self._category.children.remove(self)
+        self._category = value
+        if value is not None:
+            value.children.append(self)
+        self._reindex()
+    def _reindex(self):
+        # Precompute ancestry so that member() and depth are O(1)
+        if self._category is None:
+            self.ancestors = frozenset((self,))
+            self._level = self._depth
+        else:
+            self.ancestors = self._category.ancestors | frozenset((self,))
+            self._level = self._category._level + 1
+        for child in self.children:
+            child._reindex()
     @property
     def depth(self):
-        if self.category is None:
-            return self._depth
-        return self.category.depth + 1
+        return self._level
     @depth.setter
     def depth(self, value):
         self._depth = value
+        self._reindex()
     def member(self, other):
-        if self == other:
-            return True
-        if self.category:
-            return self.category.member(other)
-        return False
+        return other in self.ancestors
+    def __reduce__(self):
+        # The standard destinations are module constants; keep them unique
+        for k, v in globals().items():
+            if v is self:
+                return k
+        return object.__reduce__(self)
     def __str__(self):
         return self.abbr
     __repr__ = __str__ # XXX naughty
@@ -217,35 +288,34 @@ Neptune = Destination("Neptune", "N", "The more distant of Sol's pair of ice gia
 Pluto = Destination("Pluto", "P", "Distant, eccentric and small, this icy world is a planet whether the IAU likes it or not.", IP)
 Charon = Destination("Charon", "K", "Largest moon of Pluto, large enough to form a binary system with its primary.", Pluto) # K for 'Karon', to avoid confusion with Cronos
 
-class Picture(object):
+class Picture(Catalogued):
+    __slots__ = ('path', 'alt', 'caption', '_caption')
+    _inherited = ('caption',)
     def __init__(self, path, alt, caption=None):
+        super(Picture, self).__init__()
         self.path = path
         self.alt = alt
-        self._caption = caption
-    @property
-    def caption(self):
-        if self._caption is None:
-            return self.alt
-        return self._caption
-    @caption.setter
-    def caption(self, value):
-        self._caption = value
-
-class Payload(object):
+        self.caption = caption
+    def _inherit(self, attr, own):
+        if own is None:
+            return getattr(self, 'alt', None)
+        return own
+
+class Payload(Catalogued):
+    __slots__ = ('name', '_name', 'description', 'paren', 'pics', 'launch')
+    _inherited = ('name',)
     def __init__(self, name, description=None, paren=None, pics=None):
-        self._name = name
+        super(Payload, self).__init__()
+        self.name = name
         self.description = description
         self.paren = paren
         self.pics = pics or list()
         self.launch = None
-    @property
-    def name(self):
-        if self._name is None and self.paren is not None:
-            return '[%s]' % (self.paren,)
-        return self._name
-    @name.setter
-    def name(self, value):
-        self._name = value
+    def _inherit(self, attr, own):
+        paren = getattr(self, 'paren', None)
+        if own is None and paren is not None:
+            return '[%s]' % (paren,)
+        return own
     def add_pic(self, pic):
         self.pics.append(pic)
     @property
@@ -254,6 +324,89 @@ class Payload(object):
             return self.launch.launch_pic
         return None
 
+class Result(object):
+    """A launch result (see Launch), decoded once.
+
+    outcome is one of SUCCESS, MISSION_FAILURE, STAGE_FAILURE and SCRUB;
+    stage is the number of the failing stage that decided it (or 0), and
+    extra the further failing stages listed after it.  Bit n-1 of failed is
+    set if stage n failed, and failures[n-1] is how many times.  flew is
+    false for a scrub, and lv_field is the stat (as in Database.lvs) the LV
+    counts towards.  Results are interned, so get them with Result.of(code).
+
+    A tuple result counts as a flight, and as a failure of its LV, whatever
+    its primary code; its stages above the one that failed are not counted
+    (nor are their engines), and nor are the failing stage's other engines."""
+    __slots__ = ('code', 'outcome', 'stage', 'extra', 'failed', 'failures', 'flew', 'lv_field', '_stages')
+    SUCCESS, MISSION_FAILURE, STAGE_FAILURE, SCRUB = range(4)
+    OUTCOMES = ('success', 'mission failure', 'stage failure', 'scrub')
+    LV_FIELDS = ('success', 'mission_failure', 'failure', 'scrub')
+    _interned = {}
+    @classmethod
+    def of(cls, code):
+        if isinstance(code, Result):
+            return code
+        if code not in cls._interned:
+            cls._interned[code] = cls(code)
+        return cls._interned[code]
+    def __init__(self, code):
+        self.code = code
+        if isinstance(code, tuple):
+            primary, self.extra = code[0], tuple(code[1:])
+        else:
+            primary, self.extra = code, ()
+        if primary == 0:
+            self.outcome = self.SUCCESS
+        elif primary == -2:
+            self.outcome = self.SCRUB
+        elif primary < 0:
+            self.outcome = self.MISSION_FAILURE
+        else:
+            self.outcome = self.STAGE_FAILURE
+        self.stage = primary if self.outcome == self.STAGE_FAILURE else 0
+        tupled = isinstance(code, tuple)
+        self.flew = tupled or self.outcome != self.SCRUB
+        self.lv_field = 'failure' if tupled else self.LV_FIELDS[self.outcome]
+        counts = {}
+        for n in ((self.stage,) if self.stage else ()) + self.extra:
+            counts[n] = counts.get(n, 0) + 1
+        self.failed = sum(1 << (n - 1) for n in counts)
+        self.failures = tuple(counts.get(n, 0) for n in xrange(1, max(counts or [0]) + 1))
+        self._stages = {}
+    def __reduce__(self):
+        # decoded afresh when unpickled (an equal, if not interned, Result)
+        return (Result, (self.code,))
+    @property
+    def name(self):
+        return self.OUTCOMES[self.outcome]
+    def stages(self, engines):
+        """For each stage, given how many engines each has: the stat (as in
+        Database.stages) it counts towards, or None; how many times it
+        failed; the stat its engines that did not fail count towards; and
+        how many of them there were (none, if it failed more times than it
+        has engines)."""
+        if engines not in self._stages:
+            stages = []
+            for n, count in enumerate(engines, 1):
+                if self.outcome == self.SUCCESS:
+                    field = 'success'
+                elif self.outcome == self.SCRUB:
+                    field = 'scrub' if n == 1 else None
+                elif self.outcome == self.MISSION_FAILURE or self.stage > n:
+                    field = 'mission_failure'
+                elif self.stage < n:
+                    field = None if isinstance(self.code, tuple) else 'lower_failure'
+                else:
+                    field = 'failure'
+                fails = self.failures[n - 1] if n <= len(self.failures) else 0
+                others = field
+                if field == 'failure':
+                    # a failing stage's other engines worked, but the mission failed
+                    others = None if isinstance(self.code, tuple) else 'mission_failure'
+                stages.append((field, fails, others, max(count - fails, 0)))
+            self._stages[engines] = tuple(stages)
+        return self._stages[engines]
+
 class Launch(object):
     def __init__(self, name, when, lv, payload, dest, result, comments=None, pics=None):
         """Result semantics:
@@ -262,17 +415,27 @@ class Launch(object):
         -1 = Mission failure (all stages worked but design error killed mission)
         0 = Success
         positive = number of failing stage
-        tuple: [0] as above, remainder are further failing stages"""
+        tuple: [0] as above, remainder are further failing stages
+
+        The result is decoded into status (a Result), afresh whenever it is
+        set.  A launch already in a Database should be changed with
+        amend_launch(), so that its stats are."""
         self.name = name
         self.date = when
         self.lv = lv
         self.payload = payload
-        if self.payload and result != -2:
+        self.result = result
+        if self.payload and self.status.flew:
             self.payload.launch = self
         self.dest = dest
-        self.result = result
         self.comments = comments
         self.pics = pics or list()
+    @property
+    def result(self):
+        return self.status.code
+    @result.setter
+    def result(self, result):
+        self.status = Result.of(result)
     def add_pic(self, pic):
         self.pics.append(pic)
     @property
@@ -281,6 +444,156 @@ class Launch(object):
             return self.pics[0]
         return None
 
+class LaunchView(object):
+    """A row of a LaunchTable, behaving like a Launch."""
+    __slots__ = ('table', 'row')
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+    def __eq__(self, other):
+        return isinstance(other, LaunchView) and self.table is other.table and self.row == other.row
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        return hash(self.row)
+    def __reduce__(self):
+        return LaunchView, (self.table, self.row)
+    @property
+    def name(self):
+        return self.table.names[self.row]
+    @property
+    def date(self):
+        return self.table.day(self.table.dates[self.row])
+    @property
+    def lv(self):
+        return self.table.lv_ids.items[self.table.lvs[self.row]]
+    @property
+    def payload(self):
+        return self.table.payloads[self.row]
+    @property
+    def dest(self):
+        return self.table.dest_ids.items[self.table.dests[self.row]]
+    @property
+    def result(self):
+        return self.status.code
+    @property
+    def status(self):
+        return self.table.result_ids.items[self.table.results[self.row]]
+    @property
+    def comments(self):
+        return self.table.comments.get(self.row)
+    @property
+    def pics(self):
+        return self.table.pics.get(self.row, ())
+    def add_pic(self, pic):
+        self.table.pics.setdefault(self.row, []).append(pic)
+    @property
+    def launch_pic(self):
+        pics = self.table.pics.get(self.row)
+        if pics:
+            return pics[0]
+        return None
+
+class _Interner(object):
+    def __init__(self):
+        self.items = []
+        self.ids = {}
+    def __call__(self, item):
+        if item not in self.ids:
+            self.ids[item] = len(self.items)
+            self.items.append(item)
+        return self.ids[item]
+
+class LaunchTable(object):
+    """Columnar store of launches, usable in place of a list of Launch.
+
+    Launches are kept as rows of compact arrays (interned LV, destination
+    and Result ids, date ordinals) and handed out as LaunchViews, made
+    whenever asked for and not kept: two views of a row are equal.  Rows
+    are never reused, so a view of a removed launch stays valid."""
+    def __init__(self, launches=()):
+        self.names = []
+        self.dates = array.array('l')
+        self.lv_ids = _Interner()
+        self.lvs = array.array('l')
+        self.payloads = []
+        self.dest_ids = _Interner()
+        self.dests = array.array('l')
+        self.result_ids = _Interner()
+        self.results = array.array('l')
+        self.comments = {}
+        self.pics = {}
+        self.order = array.array('l') # rows, in launch order
+        self.days = {} # ordinal: date, shared by the rows
+        for launch in launches:
+            self.append(launch)
+    def add(self, name, when, lv, payload, dest, result, comments=None, pics=None):
+        """Store a new row and return a view of it; arguments as for Launch."""
+        row = len(self.names)
+        self.names.append(name)
+        self.dates.append(when.toordinal())
+        self.lvs.append(self.lv_ids(lv))
+        self.payloads.append(payload)
+        self.dests.append(self.dest_ids(dest))
+        status = Result.of(result)
+        self.results.append(self.result_ids(status))
+        if comments is not None:
+            self.comments[row] = comments
+        if pics:
+            self.pics[row] = pics
+        view = LaunchView(self, row)
+        if payload and status.flew:
+            payload.launch = view
+        return view
+    def groups(self):
+        """(n, launch) for each combination of LV, destination and result
+        among the launches: n launches have it, of which launch is one.
+        The stats only depend on those, so can be tallied a group at a time."""
+        groups = {}
+        lvs, dests, results = self.lvs, self.dests, self.results
+        for row in self.order:
+            key = (lvs[row], dests[row], results[row])
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [1, row]
+            else:
+                group[0] += 1
+        return [(n, self.view(row)) for n, row in groups.itervalues()]
+    def view(self, row):
+        return LaunchView(self, row)
+    def __getstate__(self):
+        # the dates are made again from the ordinals when wanted
+        state = dict(self.__dict__)
+        state['days'] = {}
+        return state
+    def day(self, ordinal):
+        if ordinal not in self.days:
+            self.days[ordinal] = date.fromordinal(ordinal)
+        return self.days[ordinal]
+    def _row(self, launch):
+        if isinstance(launch, LaunchView) and launch.table is self:
+            return launch.row
+        return self.add(launch.name, launch.date, launch.lv, launch.payload, launch.dest, launch.result, launch.comments, launch.pics).row
+    def __len__(self):
+        return len(self.order)
+    def __iter__(self):
+        for row in self.order:
+            yield self.view(row)
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.view(row) for row in self.order[i]]
+        return self.view(self.order[i])
+    def __setitem__(self, i, launch):
+        self.order[i] = self._row(launch)
+    def append(self, launch):
+        self.order.append(self._row(launch))
+    def index(self, launch):
+        if not (isinstance(launch, LaunchView) and launch.table is self):
+            raise ValueError("launch not in table")
+        return self.order.index(launch.row)
+    def remove(self, launch):
+        del self.order[self.index(launch)]
+
 class Flight(object):
     def __init__(self, name, when, ac, crew, comments=None, pics=None):
         self.name = name
@@ -299,45 +612,605 @@ class Flight(object):
             return self.pics[0]
         return None
 
+class SearchIndex(object):
+    """Inverted index of words to the documents they appear in.
+
+    A document is any hashable key, added with the (weight, text) pairs to
+    index it by; text may also be None, or a sequence of strings (a crew).
+    Query words match any indexed word they are a prefix of; whole-word
+    matches score double.  For that the words are sorted, but only when
+    first searched for after they have changed, as adding them one at a
+    time to a sorted list would take time in proportion to all of them."""
+    _word = re.compile(r'\w+', re.UNICODE)
+    def __init__(self):
+        self.postings = {} # word: {doc: weight}
+        self.docs = {} # doc: (its words), the weights being in postings
+        self._words = [] # sorted, or None if postings has changed since
+    @classmethod
+    def tokenize(cls, text):
+        if not isinstance(text, unicode):
+            text = text.decode('utf8', 'replace')
+        return cls._word.findall(text.lower())
+    def add(self, doc, fields):
+        if doc in self.docs:
+            self.remove(doc)
+        words = {}
+        for weight, text in fields:
+            if isinstance(text, (tuple, list)):
+                text = ' '.join(text)
+            if text:
+                for word in self.tokenize(text):
+                    words[word] = words.get(word, 0) + weight
+        self.docs[doc] = tuple(words)
+        for word, weight in words.iteritems():
+            if word not in self.postings:
+                self.postings[word] = {}
+                self._words = None
+            self.postings[word][doc] = weight
+    def remove(self, doc):
+        for word in self.docs.pop(doc, ()):
+            posting = self.postings[word]
+            del posting[doc]
+            if not posting:
+                del self.postings[word]
+                self._words = None
+    def search(self, query):
+        """{doc: score} for the documents matching every word of query."""
+        if self._words is None:
+            self._words = sorted(self.postings)
+        words = self._words
+        terms = []
+        for term in set(self.tokenize(query)):
+            lo = hi = bisect.bisect_left(words, term)
+            while hi < len(words) and words[hi].startswith(term):
+                hi += 1
+            terms.append((sum(len(self.postings[w]) for w in words[lo:hi]), term, lo, hi))
+        if not terms:
+            return {}
+        # start from the rarest term, then whittle down its matches
+        terms.sort()
+        size, term, lo, hi = terms[0]
+        scores = {}
+        for word in words[lo:hi]:
+            boost = 2 if word == term else 1
+            for doc, weight in self.postings[word].iteritems():
+                scores[doc] = scores.get(doc, 0) + weight * boost
+        for size, term, lo, hi in terms[1:]:
+            for doc in scores.keys():
+                score = 0
+                for word in self.docs[doc]:
+                    if word.startswith(term):
+                        score += self.postings[word][doc] * (2 if word == term else 1)
+                if score:
+                    scores[doc] += score
+                else:
+                    del scores[doc]
+        return scores
+
+class _Launches(collections.Mapping):
+    """Read-only dict over one of a Database's indexes of launch ids, whose
+    values are the launches themselves (a list of them for a list of ids),
+    looked up when asked for."""
+    def __init__(self, db, ids):
+        self.db = db
+        self.ids = ids
+    def __getitem__(self, key):
+        ids = self.ids[key]
+        if isinstance(ids, list):
+            return [self.db._launch(i) for i in ids]
+        return self.db._launch(ids)
+    def __contains__(self, key):
+        return key in self.ids
+    def __iter__(self):
+        return iter(self.ids)
+    def __len__(self):
+        return len(self.ids)
+
 class Database(object):
+    SNAPSHOT_MAGIC = 'EKDB'
+    SNAPSHOT_VERSION = 2
     def __init__(self, launches, flights=None):
         self.launches = launches
         self.flights = flights or []
+        self.version = 0
+        self._rollup_version = None
+        self._prefix_version = None
         self.update()
+    def _ref(self, key):
+        """Take a reference on a tree node; returns True if the node is new."""
+        n = self._refs.get(key, 0)
+        self._refs[key] = n + 1
+        return not n
+    def _unref(self, key):
+        """Drop a reference on a tree node; returns True if the node is now dead."""
+        n = self._refs[key] - 1
+        if n:
+            self._refs[key] = n
+            return False
+        del self._refs[key]
+        return True
     def add_lv(self, lv):
-        self.lvs.setdefault(lv.name, {'lv': lv, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}})
-        if lv.name not in self.lv_tree:
+        if self._ref(('lv', lv.name)):
+            self.lvs[lv.name] = {'lv': lv, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}}
             self.lv_tree[lv.name] = {}
-        fam = getattr(lv, "family", None)
-        if fam:
-            self.add_lv(fam)[lv.name] = self.lv_tree[lv.name]
+            self._catalogue_text.add(('lv', lv.name), [(3, lv.name), (1, lv.description)])
+            fam = getattr(lv, "family", None)
+            if fam:
+                self.add_lv(fam)[lv.name] = self.lv_tree[lv.name]
         return self.lv_tree[lv.name]
+    def remove_lv(self, lv):
+        if self._unref(('lv', lv.name)):
+            del self.lvs[lv.name]
+            del self.lv_tree[lv.name]
+            self._catalogue_text.remove(('lv', lv.name))
+            fam = getattr(lv, "family", None)
+            if fam:
+                del self.lv_tree[fam.name][lv.name]
+                self.remove_lv(fam)
     def add_stage(self, stage):
-        self.add_engine(stage.engine)
-        self.stages.setdefault(stage.name, {'stage': stage, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'lower_failure': 0, 'failure': 0, 'dest': {}})
-        if stage.name not in self.stage_tree:
+        if self._ref(('stage', stage.name)):
+            self.add_engine(stage.engine)
+            self.stages[stage.name] = {'stage': stage, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'lower_failure': 0, 'failure': 0, 'dest': {}}
             self.stage_tree[stage.name] = {}
-        fam = getattr(stage, "family", None)
-        if fam:
-            self.add_stage(fam)[stage.name] = self.stage_tree[stage.name]
+            self._catalogue_text.add(('stage', stage.name), [(3, stage.name), (1, stage.description)])
+            fam = getattr(stage, "family", None)
+            if fam:
+                self.add_stage(fam)[stage.name] = self.stage_tree[stage.name]
         return self.stage_tree[stage.name]
+    def remove_stage(self, stage):
+        if self._unref(('stage', stage.name)):
+            del self.stages[stage.name]
+            del self.stage_tree[stage.name]
+            self._catalogue_text.remove(('stage', stage.name))
+            fam = getattr(stage, "family", None)
+            if fam:
+                del self.stage_tree[fam.name][stage.name]
+                self.remove_stage(fam)
+            self.remove_engine(stage.engine)
     def add_engine(self, eng):
-        self.engines.setdefault(eng.name, {'engine': eng, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'lower_failure': 0, 'failure': 0, 'dest': {}})
-        if eng.name not in self.engine_tree:
+        if self._ref(('engine', eng.name)):
+            self.engines[eng.name] = {'engine': eng, 'success': 0, 'scrub': 0, 'mission_failure': 0, 'lower_failure': 0, 'failure': 0, 'dest': {}}
             self.engine_tree[eng.name] = {}
-        fam = getattr(eng, "family", None)
-        if fam:
-            self.add_engine(fam)[eng.name] = self.engine_tree[eng.name]
+            self._catalogue_text.add(('engine', eng.name), [(3, eng.name), (1, eng.description)])
+            fam = getattr(eng, "family", None)
+            if fam:
+                self.add_engine(fam)[eng.name] = self.engine_tree[eng.name]
         return self.engine_tree[eng.name]
+    def remove_engine(self, eng):
+        if self._unref(('engine', eng.name)):
+            del self.engines[eng.name]
+            del self.engine_tree[eng.name]
+            self._catalogue_text.remove(('engine', eng.name))
+            fam = getattr(eng, "family", None)
+            if fam:
+                del self.engine_tree[fam.name][eng.name]
+                self.remove_engine(fam)
     def add_dest(self, dest):
-        d = {}
-        if dest not in self.dest_tree:
-            self.dest_tree[dest] = d
-        fam = dest.category
-        if fam:
-            self.add_dest(fam)[dest.name] = d
-        return d
+        if self._ref(('dest', dest)):
+            self.dest_tree[dest] = {}
+            fam = dest.category
+            if fam:
+                self.add_dest(fam)[dest.name] = self.dest_tree[dest]
+        return self.dest_tree[dest]
+    def remove_dest(self, dest):
+        if self._unref(('dest', dest)):
+            del self.dest_tree[dest]
+            fam = dest.category
+            if fam:
+                del self.dest_tree[fam][dest.name]
+                self.remove_dest(fam)
+    @classmethod
+    def _date_key(cls, kind, d):
+        # people are just names
+        return (kind, d[kind] if kind == 'person' else d[kind].name)
+    def _add_date(self, kind, d, when):
+        dates = self._dates.setdefault(self._date_key(kind, d), [])
+        bisect.insort(dates, when)
+        d['first'] = dates[0]
+        d['last'] = dates[-1]
+    def _remove_date(self, kind, d, when):
+        key = self._date_key(kind, d)
+        dates = self._dates[key]
+        del dates[bisect.bisect_left(dates, when)]
+        if dates:
+            d['first'] = dates[0]
+            d['last'] = dates[-1]
+        else:
+            del self._dates[key]
+            del d['first']
+            del d['last']
+    @classmethod
+    def _count_dest(cls, d, dest, n):
+        c = d['dest'].get(dest, 0) + n
+        if c:
+            d['dest'][dest] = c
+        else:
+            del d['dest'][dest]
+    def _tally(self, launch, sign, lvs=None, stages=None, engines=None):
+        """Add (sign=1) or subtract (sign=-1) a launch's contribution to the stats.
+
+        Tree nodes must already exist; the caller handles first/last dates.
+        The stats go in self.lvs, self.stages and self.engines unless other
+        dicts are given."""
+        if lvs is None:
+            lvs, stages, engines = self.lvs, self.stages, self.engines
+        status = launch.status
+        lv = lvs[launch.lv.name]
+        lv[status.lv_field] += sign
+        flew = status.flew
+        if flew:
+            self._count_dest(lv, launch.dest, sign)
+        engine_counts = tuple(stage.engine_count for stage in launch.lv.stages)
+        for stage, (field, fails, others, working) in zip(launch.lv.stages, status.stages(engine_counts)):
+            st = stages[stage.name]
+            en = engines[stage.engine.name]
+            if fails:
+                st['failure'] += sign
+                en['failure'] += sign * fails
+            elif field:
+                st[field] += sign
+            if others:
+                en[others] += sign * working
+            if flew:
+                self._count_dest(st, launch.dest, sign)
+                self._count_dest(en, launch.dest, sign * stage.engine_count)
+    def _launch(self, i):
+        """The launch with id i: a view of row i, if the launches are in a
+        LaunchTable, or else the i'th launch ever recorded."""
+        if self._rows is None:
+            return LaunchView(self.launches, i)
+        return self._rows[i]
+    def _identify(self, i, seq):
+        """Give self.launches[i] an id, and the place seq in launch order;
+        returns the id.  The indexes hold ids rather than launches, so the
+        views of a LaunchTable are only made when a launch is looked up."""
+        if self._rows is None:
+            ident = self.launches.order[i]
+        else:
+            ident = len(self._rows)
+            self._rows.append(self.launches[i])
+        if ident >= len(self._seq):
+            self._seq.extend([0] * (ident + 1 - len(self._seq)))
+        self._seq[ident] = seq
+        return ident
+    def _insert_ordered(self, l, ident):
+        """Insert a launch id into list l, keeping l in self.launches order."""
+        seq = self._seq[ident]
+        i = len(l)
+        while i and self._seq[l[i - 1]] > seq:
+            i -= 1
+        l.insert(i, ident)
+    def _reindex_name(self, name):
+        named = [i for i in self._named.get(name, []) if self._launch(i).status.flew]
+        if named:
+            self._by_name[name] = named[-1]
+        else:
+            self._by_name.pop(name, None)
+    def _reindex_payload(self, name):
+        carried = self._carried.get(name)
+        if carried:
+            self.payloads[name] = self._launch(carried[-1]).payload
+        else:
+            self.payloads.pop(name, None)
+    @property
+    def launches_by_year(self):
+        return _Launches(self, self._years)
+    @property
+    def launches_by_name(self):
+        """The latest launch of each name which flew."""
+        return _Launches(self, self._by_name)
+    @classmethod
+    def _lv_keys(cls, lv):
+        """Index keys for an LV: it, and every stage and engine it flies,
+        with their families."""
+        keys = set()
+        def walk(kind, item):
+            while item:
+                keys.add((kind, item.name))
+                item = getattr(item, "family", None)
+        walk('lv', lv)
+        for stage in lv.stages:
+            walk('stage', stage)
+            walk('engine', stage.engine)
+        return keys
+    @classmethod
+    def _posting_keys(cls, launch):
+        """Index keys for a launch: its year, and its LV's keys."""
+        return cls._lv_keys(launch.lv) | set([None, ('year', launch.date.year)])
+    def _post(self, ident, launch):
+        entry = (launch.date, self._seq[ident], ident)
+        for key in self._posting_keys(launch):
+            bisect.insort(self._postings.setdefault(key, []), entry)
+    def _unpost(self, ident, launch):
+        entry = (launch.date, self._seq[ident], ident)
+        for key in self._posting_keys(launch):
+            posting = self._postings[key]
+            del posting[bisect.bisect_left(posting, entry)]
+            if not posting:
+                del self._postings[key]
+    RESULT_CLASSES = Result.OUTCOMES
+    def _count_cells(self, launch, n):
+        """Add n to the crosstab cells a launch counts in: one for the launch
+        itself, one for its LV, and one for each stage it flew and its engine,
+        each keyed by month, destination and result class.  The cells are
+        kept as {(kind, name): {(year, month, destination, result class): n}},
+        so that all a launch's cells share the one key."""
+        keys = [(None, None), ('lv', launch.lv.name)]
+        for stage in launch.lv.stages:
+            keys.append(('stage', stage.name))
+            keys.append(('engine', stage.engine.name))
+        rest = (launch.date.year, launch.date.month, launch.dest, launch.status.name)
+        for key in keys:
+            cells = self._cells.setdefault(key, {})
+            c = cells.get(rest, 0) + n
+            if c:
+                cells[rest] = c
+            else:
+                del cells[rest]
+                if not cells:
+                    del self._cells[key]
+    @classmethod
+    def _crew_named(cls, launch):
+        """(names, sure) for whoever a launch's payload paren may name.
+
+        A tuple is a crew; a lone string on a named payload may be a crew of
+        one, or may be a note ('unmanned', a callsign, cargo)."""
+        payload = launch.payload
+        paren = payload.paren if payload else None
+        if isinstance(paren, tuple):
+            return set(paren), True
+        if paren and payload._name:
+            return (paren,), False
+        return (), False
+    def crew_of(self, launch):
+        """Crew of a crewed launch, or ().  A lone name counts if that
+        person is also named in some crew list (of a launch or a flight)."""
+        names, sure = self._crew_named(launch)
+        if sure:
+            return launch.payload.paren
+        return tuple(name for name in names if self._careers[name]['known'])
+    def _career(self, name):
+        if name not in self._careers:
+            self._careers[name] = {'person': name, 'flights': [], 'launches': [], 'flown': 0, 'success': 0, 'known': 0}
+        return self._careers[name]
+    def _add_crew(self, ident, launch):
+        names, sure = self._crew_named(launch)
+        flew = launch.status.flew
+        for name in names:
+            p = self._career(name)
+            p['known'] += sure
+            self._insert_ordered(p['launches'], ident)
+            if flew:
+                p['flown'] += 1
+                p['success'] += launch.status.outcome == Result.SUCCESS
+                self._add_date('person', p, launch.date)
+    def _remove_crew(self, ident, launch):
+        names, sure = self._crew_named(launch)
+        flew = launch.status.flew
+        for name in names:
+            p = self._careers[name]
+            p['known'] -= sure
+            p['launches'].remove(ident)
+            if flew:
+                p['flown'] -= 1
+                p['success'] -= launch.status.outcome == Result.SUCCESS
+                self._remove_date('person', p, launch.date)
+            if not p['launches'] and not p['flights']:
+                del self._careers[name]
+    def _count_use(self, launch, n):
+        """Add n to the launches of a launch's LV.  Usage only changes when
+        an LV first flies, or is no longer flown: then each of its stages
+        (and the stages' families) is carried by the LV, and each engine
+        (and the engines' families) used by the stage and carried by the LV.
+        The pairs counted are kept, and exactly those are taken off again,
+        even if the catalogue has changed in between."""
+        flown = self._flown.get(launch.lv.name, 0)
+        if flown + n:
+            self._flown[launch.lv.name] = flown + n
+        else:
+            del self._flown[launch.lv.name]
+        if flown and flown + n:
+            return
+        if n < 0:
+            pairs = self._use_pairs.pop(launch.lv.name)
+        else:
+            lv = ('lv', launch.lv.name)
+            pairs = self._use_pairs[launch.lv.name] = []
+            for stage in launch.lv.stages:
+                item = stage
+                while item:
+                    pairs.append((('stage', item.name), lv))
+                    item = getattr(item, "family", None)
+                item = stage.engine
+                while item:
+                    pairs.append((('engine', item.name), ('stage', stage.name)))
+                    pairs.append((('engine', item.name), lv))
+                    item = getattr(item, "family", None)
+        for key, user in pairs:
+            users = self._users.setdefault(key, {})
+            c = users.get(user, 0) + n
+            if c:
+                users[user] = c
+            else:
+                del users[user]
+                if not users:
+                    del self._users[key]
+    @classmethod
+    def _launch_fields(cls, launch):
+        """What a launch is found by in a search, as for SearchIndex.add."""
+        fields = [(3, launch.name), (1, launch.comments)]
+        payload = launch.payload
+        if payload:
+            fields.extend([(2, payload._name), (1, payload.description), (1, payload.paren)])
+        return fields
+    def _account(self, ident, launch):
+        lv, when = launch.lv, launch.date
+        self.add_lv(lv)
+        self._add_date('lv', self.lvs[lv.name], when)
+        for stage in lv.stages:
+            self.add_stage(stage)
+            self._add_date('stage', self.stages[stage.name], when)
+            self._add_date('engine', self.engines[stage.engine.name], when)
+        self.add_dest(launch.dest)
+        self._tally(launch, 1)
+        self._insert_ordered(self._named.setdefault(launch.name, []), ident)
+        self._reindex_name(launch.name)
+        payload = launch.payload
+        if payload and payload._name:
+            self._insert_ordered(self._carried.setdefault(payload.name, []), ident)
+            self._reindex_payload(payload.name)
+        self._insert_ordered(self._years.setdefault(when.year, []), ident)
+        self._post(ident, launch)
+        self._count_cells(launch, 1)
+        self._text.add(('launch', ident), self._launch_fields(launch))
+        self._add_crew(ident, launch)
+        self._count_use(launch, 1)
+    def _unaccount(self, ident, launch):
+        lv, when = launch.lv, launch.date
+        self._count_use(launch, -1)
+        self._remove_crew(ident, launch)
+        self._text.remove(('launch', ident))
+        self._count_cells(launch, -1)
+        self._unpost(ident, launch)
+        self._tally(launch, -1)
+        self._remove_date('lv', self.lvs[lv.name], when)
+        self.remove_lv(lv)
+        for stage in lv.stages:
+            self._remove_date('stage', self.stages[stage.name], when)
+            self._remove_date('engine', self.engines[stage.engine.name], when)
+            self.remove_stage(stage)
+        self.remove_dest(launch.dest)
+        self._named[launch.name].remove(ident)
+        if not self._named[launch.name]:
+            del self._named[launch.name]
+        self._reindex_name(launch.name)
+        payload = launch.payload
+        if payload and payload._name:
+            self._carried[payload.name].remove(ident)
+            if not self._carried[payload.name]:
+                del self._carried[payload.name]
+            self._reindex_payload(payload.name)
+        year = self._years[when.year]
+        year.remove(ident)
+        if not year:
+            del self._years[when.year]
+    def _find(self, name):
+        if name not in self._named:
+            raise Exception("No such launch '%s'"%(name,))
+        return self._named[name][-1]
+    def find_launch(self, name):
+        """Most recently recorded launch called name, including T-0 scrubs."""
+        return self._launch(self._find(name))
+    def _forget(self, ident):
+        """Let go of a launch no longer recorded; its id is not reused."""
+        if self._rows is not None:
+            self._rows[ident] = None
+    def add_launch(self, launch):
+        """Record a new launch, updating only the stats it touches."""
+        self._index()
+        self.launches.append(launch)
+        ident = self._identify(-1, self._next_seq)
+        self._next_seq += 1
+        self._account(ident, self._launch(ident)) # a view, if launches is a LaunchTable
+        self._changed()
+    def remove_launch(self, name):
+        """Forget a launch (the latest one of that name), as if it had never been recorded."""
+        self._index()
+        ident = self._find(name)
+        launch = self._launch(ident)
+        self._unaccount(ident, launch)
+        self._forget(ident)
+        self.launches.remove(launch)
+        self._changed()
+        if launch.payload and launch.payload.launch == launch:
+            launch.payload.launch = None
+        return launch
+    def amend_launch(self, name, launch):
+        """Replace the launch called name with launch, keeping its place in the history."""
+        self._index()
+        ident = self._find(name)
+        old = self._launch(ident)
+        self._unaccount(ident, old)
+        self._forget(ident)
+        i = self.launches.index(old)
+        self.launches[i] = launch
+        ident = self._identify(i, self._seq[ident])
+        if old.payload and old.payload.launch == old:
+            old.payload.launch = None
+        self._account(ident, self._launch(ident))
+        self._changed()
+        return old
+    def _changed(self):
+        self.version += 1
+        self.modified = time.time()
+    def save(self, fn, checksum=None):
+        """Write a snapshot of the database (catalogue, launches, flights
+        and stats) to fn.
+
+        checksum identifies the data the database was built from; load()
+        can then refuse the snapshot if given a different one.  The family
+        roll-ups are computed first, so that they are saved too.  The
+        indexes over the launches (see _index) and the running totals are
+        left out: they are far bigger than the launches, and would take
+        longer to load than to build again when first used."""
+        self.lv_families, self.stage_families, self.engine_families
+        state = dict((k, v) for k, v in self.__dict__.iteritems() if k not in self.INDEXES)
+        state.pop('_prefixes', None)
+        state['_prefix_version'] = None
+        body = cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)
+        header = '%s %d %s %s %s\n' % (self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, source_checksum(), checksum or '-', hashlib.sha1(body).hexdigest())
+        _write_file(fn, header + body)
+    @classmethod
+    def load(cls, fn, checksum=None):
+        """Read a snapshot written by save().
+
+        Returns None if there is no snapshot, or if it is stale (written by a
+        different version of this module, or, if checksum is given, from data
+        with a different checksum) or corrupt, in which case the caller should
+        rebuild.  The file is mapped rather than read, so that it can be
+        checksummed in place; the pickle is then copied out, as cPickle
+        reads a string much faster than a file.  The stats are there as
+        soon as it is loaded; the indexes are built when first needed."""
+        try:
+            with open(fn, 'rb') as f:
+                snap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
+        try:
+            header = snap.readline().split()
+            if len(header) != 5 or header[0] != cls.SNAPSHOT_MAGIC or header[1] != str(cls.SNAPSHOT_VERSION):
+                return None
+            if header[2] != source_checksum() or (checksum is not None and header[3] != checksum):
+                return None
+            if header[4] != hashlib.sha1(buffer(snap, snap.tell())).hexdigest():
+                return None
+            db = cls.__new__(cls)
+            # everything unpickled is new and live, so there is no point in
+            # the collector going over it again and again as it is made
+            enabled = gc.isenabled()
+            gc.disable()
+            try:
+                db.__dict__.update(cPickle.loads(snap[snap.tell():]))
+            finally:
+                if enabled:
+                    gc.enable()
+            return db
+        finally:
+            snap.close()
+    @classmethod
+    def _widen(cls, d, when):
+        """Stretch a node's first and last dates to take in when."""
+        if 'first' not in d or when < d['first']:
+            d['first'] = when
+        if 'last' not in d or when > d['last']:
+            d['last'] = when
     def update(self):
+        """Recompute the stats from the launches and flights.
+
+        The indexes over them (see _index) are dropped, to be rebuilt when
+        next used, so this does no more than the stats and the few dicts
+        which pages are listed from need."""
+        self._changed()
         self.engines = {}
         self.engine_tree = {}
         self.stages = {}
@@ -345,80 +1218,116 @@ class Database(object):
         self.lvs = {}
         self.lv_tree = {}
         self.dest_tree = {}
-        self.launches_by_year = {}
+        self._years = {} # year: ids of its launches, in order
         self.payloads = {}
-        self.launches_by_name = {}
+        self._by_name = {} # launch name: id of the latest of that name which flew
         self.flights_by_name = {}
-        for launch in self.launches:
-            self.add_lv(launch.lv)
-            lv = self.lvs[launch.lv.name]
-            lv['first'] = min(lv.get('first', launch.date), launch.date)
-            lv['last'] = max(lv.get('last', launch.date), launch.date)
-            if launch.result == 0:
-                lv['success'] += 1
-            elif launch.result == -2:
-                lv['scrub'] += 1
-            elif launch.result < 0:
-                lv['mission_failure'] += 1
-            else:
-                lv['failure'] += 1
-            if launch.payload and launch.payload._name:
-                self.payloads[launch.payload.name] = launch.payload
-            if launch.result != -2:
-                lv['dest'][launch.dest] = lv['dest'].get(launch.dest, 0) + 1
-                self.launches_by_name[launch.name] = launch
-            for i,stage in enumerate(launch.lv.stages):
+        self._refs = {}
+        self._catalogue_text = SearchIndex()
+        for name in self.INDEXES:
+            self.__dict__.pop(name, None)
+        grouped = isinstance(self.launches, LaunchTable)
+        self._rows = None if grouped else [] # id: launch, unless ids are rows of the table
+        self._seq = array.array('l') # id: place in launch order
+        self._next_seq = len(self.launches)
+        for i, launch in enumerate(self.launches):
+            ident = self._identify(i, i)
+            lv, when = launch.lv, launch.date
+            self.add_lv(lv)
+            self._widen(self.lvs[lv.name], when)
+            for stage in lv.stages:
                 self.add_stage(stage)
-                st = self.stages[stage.name]
-                en = self.engines[stage.engine.name]
-                st['first'] = min(st.get('first', launch.date), launch.date)
-                en['first'] = min(en.get('first', launch.date), launch.date)
-                st['last'] = max(st.get('last', launch.date), launch.date)
-                en['last'] = max(en.get('last', launch.date), launch.date)
-                if isinstance(launch.result, tuple):
-                    fails = len([r for r in launch.result if r == i + 1])
-                    if fails:
-                        st['failure'] += 1
-                    if launch.result[0] == 0:
-                        st['success'] += not fails
-                        en['success'] += stage.engine_count - fails
-                    elif launch.result[0] == -2:
-                        if not i:
-                            st['scrub'] += not fails
-                            en['scrub'] += stage.engine_count - fails
-                    elif launch.result[0] < 0 or launch.result[0] > i + 1:
-                        st['mission_failure'] += not fails
-                        en['mission_failure'] += stage.engine_count - fails
-                    elif launch.result < i + 1:
-                        st['lower_failure'] += not fails
-                        en['lower_failure'] += stage.engine_count - fails
-                    # else failure, handled already
-                    en['failure'] += fails
-                else:
-                    if launch.result == 0:
-                        st['success'] += 1
-                        en['success'] += stage.engine_count
-                    elif launch.result == -2:
-                        if not i:
-                            st['scrub'] += 1
-                            en['scrub'] += stage.engine_count
-                    elif launch.result < 0 or launch.result > i + 1:
-                        st['mission_failure'] += 1
-                        en['mission_failure'] += stage.engine_count
-                    elif launch.result < i + 1:
-                        st['lower_failure'] += 1
-                        en['lower_failure'] += stage.engine_count
-                    else:
-                        st['failure'] += 1
-                        en['failure'] += 1
-                        en['mission_failure'] += stage.engine_count - 1
-                if launch.result != -2:
-                    st['dest'][launch.dest] = st['dest'].get(launch.dest, 0) + 1
-                    en['dest'][launch.dest] = en['dest'].get(launch.dest, 0) + stage.engine_count
+                self._widen(self.stages[stage.name], when)
+                self._widen(self.engines[stage.engine.name], when)
             self.add_dest(launch.dest)
-            self.launches_by_year.setdefault(launch.date.year, []).append(launch)
+            if not grouped:
+                self._tally(launch, 1)
+            self._years.setdefault(when.year, []).append(ident)
+            if launch.status.flew:
+                self._by_name[launch.name] = ident
+            if launch.payload and launch.payload._name:
+                self.payloads[launch.payload.name] = launch.payload
+        if grouped:
+            for n, launch in self.launches.groups():
+                self._tally(launch, n)
         for flight in self.flights:
             self.flights_by_name[flight.name] = flight
+    # built by _index, when first wanted
+    INDEXES = ('_dates', '_named', '_carried', '_postings', '_cells', '_text', '_careers',
+               '_flown', '_users', '_use_pairs', '_flight_postings', '_flight_sets')
+    def __getattr__(self, name):
+        if name in self.INDEXES:
+            self._index()
+            return self.__dict__[name]
+        raise AttributeError(name)
+    def _ids(self):
+        """Ids of the launches, in launch order."""
+        if self._rows is None:
+            return self.launches.order
+        return sorted((i for i, launch in enumerate(self._rows) if launch is not None), key=self._seq.__getitem__)
+    def _index(self):
+        """Build the indexes over the launches and flights, if they are not
+        built already: the dates of every node's launches (so that its first
+        and last can be found again when one is removed), the launches of
+        each name and payload, the posting lists, crosstab cells, search
+        words, careers and usage.
+
+        They are built in one pass over the launches in order, so the lists
+        of launches are just appended to; the posting and date lists are
+        sorted once at the end, rather than kept sorted as they grow, and
+        each LV's posting keys are only worked out once."""
+        if self.INDEXES[0] in self.__dict__:
+            return
+        self._dates = {}
+        self._named = {}
+        self._carried = {}
+        self._postings = {}
+        self._cells = {}
+        self._text = SearchIndex()
+        self._careers = {}
+        self._flown = {} # LV name: launches
+        self._users = {} # (kind, name): {(kind, name) of a stage or LV flying it: LVs}
+        self._use_pairs = {} # LV name: the (key, user) pairs counted in _users for it
+        self._flight_postings = {} # key: [flights, in order]
+        self._flight_sets = {} # key: set of the same flights
+        keys = {} # LV name: (its posting keys, its date keys)
+        for ident in self._ids():
+            launch = self._launch(ident)
+            lv, when = launch.lv, launch.date
+            if lv.name not in keys:
+                date_keys = [('lv', lv.name)]
+                for stage in lv.stages:
+                    date_keys.extend([('stage', stage.name), ('engine', stage.engine.name)])
+                keys[lv.name] = (self._lv_keys(lv) | set([None]), date_keys)
+            posting_keys, date_keys = keys[lv.name]
+            entry = (when, self._seq[ident], ident)
+            for key in posting_keys:
+                self._postings.setdefault(key, []).append(entry)
+            self._postings.setdefault(('year', when.year), []).append(entry)
+            for key in date_keys:
+                self._dates.setdefault(key, []).append(when)
+            self._named.setdefault(launch.name, []).append(ident)
+            if launch.payload and launch.payload._name:
+                self._carried.setdefault(launch.payload.name, []).append(ident)
+            self._count_cells(launch, 1)
+            self._text.add(('launch', ident), self._launch_fields(launch))
+            self._add_crew(ident, launch)
+            self._count_use(launch, 1)
+        for flight in self.flights:
+            crew = set(flight.crew)
+            for key in [('ac', flight.ac), ('year', flight.date.year)] + [('crew', name) for name in crew]:
+                self._flight_postings.setdefault(key, []).append(flight)
+                self._flight_sets.setdefault(key, set()).add(flight)
+            for name in crew:
+                p = self._career(name)
+                p['known'] += 1
+                p['flights'].append(flight)
+                self._add_date('person', p, flight.date)
+            self._text.add(('flight', flight), [(3, flight.name), (2, flight.crew), (1, flight.ac), (1, flight.comments)])
+        for l in self._postings.itervalues():
+            l.sort()
+        for l in self._dates.itervalues():
+            l.sort()
     @classmethod
     def flatten_tree(cls, tree):
         l = tree.keys()
@@ -457,24 +1366,178 @@ class Database(object):
             d['last'] = e['last']
         for k in e['dest'].keys():
             d['dest'][k] = d['dest'].get(k, 0) + e['dest'][k]
-    def lv_family(self, name):
-        fam = self.flatten_tree(self.lv_tree[name])
-        d = {'lv': self.lvs[name]['lv'], 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}}
-        for n in [name] + fam:
-            self.roll_family(d, self.lvs[n])
+    def _roll_up(self, kind, data, tree):
+        """Family roll-ups for every node of a tree, built bottom-up.
+
+        Cached until the next change to the launch data."""
+        if self._rollup_version != self.version:
+            self._rollups = {}
+            self._rollup_version = self.version
+        if kind not in self._rollups:
+            rolled = {}
+            def roll(name):
+                if name not in rolled:
+                    d = {kind: data[name][kind], 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}}
+                    self.roll_family(d, data[name])
+                    for child in tree[name]:
+                        self.roll_family(d, roll(child))
+                    rolled[name] = d
+                return rolled[name]
+            for name in data:
+                roll(name)
+            self._rollups[kind] = rolled
+        return self._rollups[kind]
+    @property
+    def lv_families(self):
+        return self._roll_up('lv', self.lvs, self.lv_tree)
+    @property
+    def stage_families(self):
+        return self._roll_up('stage', self.stages, self.stage_tree)
+    @property
+    def engine_families(self):
+        return self._roll_up('engine', self.engines, self.engine_tree)
+    STAT_FIELDS = ('success', 'scrub', 'mission_failure', 'lower_failure', 'failure')
+    def _prefix_sums(self):
+        """Running totals of every node's stats over its launches in date order.
+
+        For each (kind, name), the date ordinals of the launches counting
+        towards it, the totals of each stat before each of them (and after
+        the last), and the same for each destination.  Cached until the next
+        change to the launch data."""
+        if self._prefix_version != self.version:
+            stats = {}
+            for kind, data in (('lv', self.lvs), ('stage', self.stages), ('engine', self.engines)):
+                stats[kind] = dict((name, {'success': 0, 'scrub': 0, 'mission_failure': 0, 'lower_failure': 0, 'failure': 0, 'dest': {}}) for name in data)
+            sums = {}
+            for when, seq, ident in self._postings.get(None, []):
+                launch = self._launch(ident)
+                self._tally(launch, 1, stats['lv'], stats['stage'], stats['engine'])
+                nodes = set([('lv', launch.lv.name)])
+                for stage in launch.lv.stages:
+                    nodes.add(('stage', stage.name))
+                    nodes.add(('engine', stage.engine.name))
+                for kind, name in nodes:
+                    d = stats[kind][name]
+                    if (kind, name) not in sums:
+                        sums[(kind, name)] = (array.array('l'), dict((k, array.array('l', [0])) for k in self.STAT_FIELDS), {})
+                    dates, totals, dests = sums[(kind, name)]
+                    dates.append(when.toordinal())
+                    for k in self.STAT_FIELDS:
+                        totals[k].append(d[k])
+                    if launch.status.flew:
+                        dest = dests.setdefault(launch.dest, (array.array('l'), array.array('l', [0])))
+                        dest[0].append(when.toordinal())
+                        dest[1].append(d['dest'].get(launch.dest, 0))
+            self._prefixes = sums
+            self._prefix_version = self.version
+        return self._prefixes
+    def _window(self, kind, name, start, end):
+        """A node's stats (as in self.lvs etc.) counting only launches dated
+        in [start, end); either bound may be None."""
+        data = {'lv': self.lvs, 'stage': self.stages, 'engine': self.engines}[kind]
+        d = {kind: data[name][kind], 'dest': {}}
+        for k in self.STAT_FIELDS:
+            if k in data[name]:
+                d[k] = 0
+        sums = self._prefix_sums().get((kind, name))
+        if sums is None:
+            return d
+        def span(dates):
+            i = 0 if start is None else bisect.bisect_left(dates, start.toordinal())
+            j = len(dates) if end is None else bisect.bisect_left(dates, end.toordinal())
+            return i, j
+        dates, totals, dests = sums
+        i, j = span(dates)
+        if j > i:
+            d['first'] = date.fromordinal(dates[i])
+            d['last'] = date.fromordinal(dates[j - 1])
+        for k in d:
+            if k in totals:
+                d[k] = totals[k][j] - totals[k][i]
+        for dest, (dates, counts) in dests.items():
+            i, j = span(dates)
+            if counts[j] != counts[i]:
+                d['dest'][dest] = counts[j] - counts[i]
         return d
+    def between(self, start=None, end=None):
+        """The family statistics for just the launches dated in [start, end).
+
+        Returns a Database holding only the stats (lvs, stages, engines), the
+        trees of the entries with launches in that range, and the dest_tree,
+        which is enough for the family tables and roll-ups.  Each entry's
+        stats take a couple of bisections of its running totals (see
+        _prefix_sums), rather than a pass over the launches.  With no
+        bounds, returns this Database."""
+        if start is None and end is None:
+            return self
+        window = Database.__new__(Database)
+        window.version = self.version
+        window._rollup_version = None
+        window._prefix_version = None
+        window.dest_tree = self.dest_tree
+        for kind, data, tree in (('lv', self.lvs, self.lv_tree), ('stage', self.stages, self.stage_tree), ('engine', self.engines, self.engine_tree)):
+            stats = dict((name, self._window(kind, name, start, end)) for name in data)
+            rolled = window._roll_up(kind, stats, tree)
+            live = set(name for name in stats if 'first' in rolled[name])
+            setattr(window, kind + 's', dict((name, stats[name]) for name in live))
+            setattr(window, kind + '_tree', dict((name, {}) for name in live))
+            for name in live:
+                subtree = getattr(window, kind + '_tree')[name]
+                for child in tree[name]:
+                    if child in live:
+                        subtree[child] = getattr(window, kind + '_tree')[child]
+        window._rollup_version = None
+        return window
+    def lv_family(self, name):
+        return self.lv_families[name]
     def stage_family(self, name):
-        fam = self.flatten_tree(self.stage_tree[name])
-        d = {'stage': self.stages[name]['stage'], 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}}
-        for n in [name] + fam:
-            self.roll_family(d, self.stages[n])
-        return d
+        return self.stage_families[name]
     def engine_family(self, name):
-        fam = self.flatten_tree(self.engine_tree[name])
-        d = {'engine': self.engines[name]['engine'], 'success': 0, 'scrub': 0, 'mission_failure': 0, 'failure': 0, 'dest': {}}
-        for n in [name] + fam:
-            self.roll_family(d, self.engines[n])
-        return d
+        return self.engine_families[name]
+    @classmethod
+    def wilson(cls, successes, trials, z=1.96):
+        """Success rates, with their Wilson score intervals (95% for the
+        default z), for whole columns of counts at once.
+
+        Returns a list of (estimate, low, high), with None wherever there
+        were no trials."""
+        z2 = z * z
+        rates = []
+        for s, n in zip(successes, trials):
+            if not n:
+                rates.append(None)
+                continue
+            p = float(s) / n
+            scale = 1 + z2 / n
+            centre = (p + z2 / (2 * n)) / scale
+            half = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / scale
+            rates.append((p, max(0.0, centre - half), min(1.0, centre + half)))
+        return rates
+    def reliability(self, kind):
+        """Estimated reliability of every lv, stage or engine (kind), with
+        its family rolled up: a dict of name to (estimate, low, high,
+        flights), or None if it has no flights to judge by.
+
+        An LV counts as working only if the mission succeeded.  A stage or
+        engine counts as working if it did its part, even if the mission
+        failed elsewhere; it is not counted when a lower stage failed before
+        it fired, nor on a scrub.  Engines are counted once per engine of a
+        stage, as in the stats.  Cached until the next change to the launch
+        data."""
+        rolled = self._roll_up(kind, getattr(self, kind + 's'), getattr(self, kind + '_tree'))
+        key = ('reliability', kind)
+        if key not in self._rollups:
+            names = list(rolled)
+            if kind == 'lv':
+                worked = array.array('l', (rolled[n]['success'] for n in names))
+                failed = array.array('l', (rolled[n]['failure'] + rolled[n]['mission_failure'] for n in names))
+            else:
+                worked = array.array('l', (rolled[n]['success'] + rolled[n]['mission_failure'] for n in names))
+                failed = array.array('l', (rolled[n]['failure'] for n in names))
+            trials = array.array('l', (w + f for w, f in zip(worked, failed)))
+            rates = self.wilson(worked, trials)
+            self._rollups[key] = dict((name, rate and rate + (n,)) for name, rate, n in zip(names, rates, trials))
+        return self._rollups[key]
     def coalesce_dests(self, items, maxdepth):
         count = {}
         for item in items:
@@ -493,74 +1556,373 @@ class Database(object):
                     changes = True
         leaves = [l for l in leaves if count[l]]
         return sorted(leaves, key=lambda d:d.sort)
-    def filter_launches(self, lv=None, stage=None, engine=None, year=None):
-        lvf = self.flatten_tree({lv: self.lv_tree[lv]}) if lv else None
-        stf = self.flatten_tree({stage: self.stage_tree[stage]}) if stage else None
-        enf = self.flatten_tree({engine: self.engine_tree[engine]}) if engine else None
-        def do_filter(l):
-            if lvf is not None and l.lv.name not in lvf:
-                return False
-            if stf is not None and not any(st in [s.name for s in l.lv.stages] for st in stf):
-                return False
-            if enf is not None and not any(en in [s.engine.name for s in l.lv.stages] for en in enf):
-                return False
-            if year is not None and l.date.year != year:
-                return False
-            return True
-        return filter(do_filter, self.launches)
+    def dest_columns(self, dests):
+        """Map each destination onto the columns (from dests) its launches count towards.
+
+        A destination shown as a column counts only there; any other counts
+        towards every column it falls under."""
+        shown = set(dests)
+        return dict((n, (n,) if n in shown else tuple(d for d in dests if n.member(d))) for n in self.dest_tree)
+    @classmethod
+    def count_dests(cls, dest, columns):
+        count = {}
+        for n, c in dest.items():
+            for d in columns[n]:
+                count[d] = count.get(d, 0) + c
+        return count
+    CROSSTAB_TIMES = {'year': lambda year, month: '%d' % (year,),
+                      'quarter': lambda year, month: '%d Q%d' % (year, (month + 2) // 3),
+                      'month': lambda year, month: '%d-%02d' % (year, month)}
+    def crosstab(self, time=None, entity=None, depth=0, dest=None, result=False):
+        """Launch counts grouped by any of: time ('year', 'quarter' or
+        'month'); entity ('lv', 'stage' or 'engine'), taken at family depth
+        depth (0 for the top-level families, or the entity itself if it is
+        not that deep); destination, coalesced as coalesce_dests() would
+        with maxdepth dest; and, if result is set, result class.
+
+        Returns a dict of (time, name, destination, result class) to count,
+        with None in the parts not grouped by; times are strings such as
+        '1961', '1961 Q2' or '1961-04'.  Stage and engine groups
+        count each stage flown, so a launch on two stages of a family counts
+        twice towards it, as in the family stats.  T-0 scrubs are only
+        counted when grouping by result.  The counts are summed from cells
+        kept up to date as launches are added and removed, not by going
+        through the launches."""
+        if time is not None and time not in self.CROSSTAB_TIMES:
+            raise Exception("Can't group by time '%s'" % (time,))
+        if entity not in (None, 'lv', 'stage', 'engine'):
+            raise Exception("Can't group by '%s'" % (entity,))
+        if entity is not None:
+            data = getattr(self, entity + 's')
+            names = {}
+            def group_name(name):
+                if name not in names:
+                    chain = []
+                    item = data[name][entity]
+                    while item:
+                        chain.append(item)
+                        item = getattr(item, "family", None)
+                    names[name] = chain[max(0, len(chain) - 1 - depth)].name
+                return names[name]
+        if dest is not None:
+            counts = {}
+            for (year, month, where, rclass), n in self._cells.get((None, None), {}).iteritems():
+                if rclass != 'scrub':
+                    counts[where] = counts.get(where, 0) + n
+            columns = self.dest_columns(self.coalesce_dests([{'dest': counts}], dest))
+        table = {}
+        for (kind, name), cells in self._cells.iteritems():
+            if kind != entity:
+                continue
+            for (year, month, where, rclass), n in cells.iteritems():
+                if rclass == 'scrub' and not result:
+                    continue
+                group = (self.CROSSTAB_TIMES[time](year, month) if time else None,
+                         group_name(name) if entity else None)
+                rc = rclass if result else None
+                # as in the family tables, a destination above the columns
+                # shown counts in each of them
+                for d in columns[where] if dest is not None else (None,):
+                    key = group + (d, rc)
+                    table[key] = table.get(key, 0) + n
+        return table
+    def filter_launches(self, lv=None, stage=None, engine=None, year=None, offset=0, limit=None):
+        """Launches matching all the given filters, in date order.
+
+        lv, stage and engine match the named vehicle/stage/engine or anything
+        in its family.  offset and limit select a page of the results."""
+        return list(self.iter_launches(lv, stage, engine, year, offset, limit))
+    @classmethod
+    def _intersect(cls, first, others):
+        """Entries of the posting list first which are in all the others.
+
+        Each entry is looked up by bisecting the others, starting from where
+        the previous one was found, so the cost is set by the shortest list."""
+        starts = [0] * len(others)
+        for e in first:
+            for i, other in enumerate(others):
+                j = starts[i] = bisect.bisect_left(other, e, starts[i])
+                if j == len(other):
+                    return
+                if other[j] != e:
+                    break
+            else:
+                yield e
+    def iter_launches(self, lv=None, stage=None, engine=None, year=None, offset=0, limit=None):
+        """As filter_launches, but an iterator, which only finds each match
+        when it is asked for.
+
+        It works from a copy of the posting lists taken when it is called
+        (just of the part wanted, if there is one list), so changes to the
+        Database after that don't skip or repeat launches."""
+        keys = []
+        if lv:
+            keys.append(('lv', lv))
+        if stage:
+            keys.append(('stage', stage))
+        if engine:
+            keys.append(('engine', engine))
+        if year is not None:
+            keys.append(('year', year))
+        end = None if limit is None else offset + limit
+        if len(keys) > 1:
+            postings = sorted((list(self._postings.get(k, ())) for k in keys), key=len)
+            matches = itertools.islice(self._intersect(postings[0], postings[1:]), offset, end)
+        else:
+            matches = self._postings.get(keys[0] if keys else None, [])[offset:end]
+        return (self._launch(e[2]) for e in matches)
+    SEARCH_KINDS = {'launch': 0, 'lv': 1, 'stage': 2, 'engine': 3, 'flight': 4}
+    def search(self, query, limit=None):
+        """Launches (with their payloads), LVs, stages, engines (and their
+        families) and flights whose text matches every word of query, as
+        (kind, item) pairs: best match first, then by kind, and then in
+        launch order or by name.  limit, if given, caps the number."""
+        found = []
+        # the catalogue has its own index, kept up to date with the stats
+        scores = self._catalogue_text.search(query)
+        scores.update(self._text.search(query))
+        for (kind, item), score in scores.iteritems():
+            if kind == 'launch':
+                order = self._seq[item]
+            elif kind == 'flight':
+                order = (item.date, item.name)
+            else:
+                order = item
+            found.append((-score, self.SEARCH_KINDS[kind], order, kind, item))
+        found.sort()
+        # launches and catalogue entries are only looked up for the matches returned
+        results = []
+        for score, rank, order, kind, item in found[:limit]:
+            if kind == 'launch':
+                item = self._launch(item)
+            elif kind != 'flight':
+                item = getattr(self, kind + 's')[item][kind]
+            results.append((kind, item))
+        return results
     def filter_flights(self, ac=None, crew=None, year=None):
-        def do_filter(f):
-            if ac not in (f.ac, None):
-                return False
-            if crew not in f.crew + (None,):
-                return False
-            if year not in (str(f.date.year), None):
-                return False
-            return True
-        return filter(do_filter, self.flights)
+        """Flights matching all the given filters, in the order recorded.
+
+        crew matches any member of a flight's crew; year may be a string."""
+        keys = []
+        if ac is not None:
+            keys.append(('ac', ac))
+        if crew is not None:
+            keys.append(('crew', crew))
+        if year is not None:
+            try:
+                keys.append(('year', int(year)))
+            except ValueError:
+                return []
+        if not keys:
+            return list(self.flights)
+        keys.sort(key=lambda k: len(self._flight_postings.get(k, ())))
+        others = [self._flight_sets.get(k, ()) for k in keys[1:]]
+        return [f for f in self._flight_postings.get(keys[0], []) if all(f in o for o in others)]
+    def used_by(self, kind, name, by):
+        """Names of the stages (by='stage') or LVs (by='lv') which have flown
+        the named stage or engine, or anything in its family, sorted."""
+        return sorted(user for k, user in self._users.get((kind, name), ()) if k == by)
+    def people(self):
+        """Names of everyone who has crewed a flight or a launch, sorted."""
+        return sorted(name for name, p in self._careers.iteritems() if p['known'])
+    def person(self, name):
+        """A person's career, from the flights they crewed and the crewed
+        launches (see crew_of) they rode: those flights and launches, the
+        number of launches which flew and which succeeded, and the dates of
+        their first and last time aloft."""
+        if name not in self._careers or not self._careers[name]['known']:
+            raise Exception("No such person '%s'"%(name,))
+        p = self._careers[name]
+        return dict(p, launches=[self._launch(i) for i in p['launches']])
+
+def profile_call(func, directory, name):
+    """Call func() under cProfile, saving the stats in directory as
+    <name>-<timestamp>.prof.  Returns func's result and the file's name."""
+    import cProfile
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fn = os.path.join(directory, '%s-%d.prof' % (name, int(time.time() * 1000)))
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func), fn
+    finally:
+        prof.dump_stats(fn)
+
+def profile_summary(fn, limit=30):
+    """Summarise a profile saved by profile_call.
+
+    Returns the limit functions with the most cumulative time, as dicts of
+    calls, tottime, cumtime and function, and the total own time spent in
+    each area: this module, nevow, twisted, PIL or (the rest) python."""
+    import pstats
+    here = os.path.splitext(os.path.abspath(__file__))[0]
+    rows = []
+    areas = {}
+    for (filename, line, func), (cc, nc, tt, ct, callers) in pstats.Stats(fn).stats.items():
+        parts = filename.split(os.sep)
+        area = 'python'
+        if os.path.splitext(filename)[0] == here:
+            area = 'ek'
+        else:
+            for package in ('nevow', 'twisted', 'PIL'):
+                if package in parts:
+                    area = package
+        areas[area] = areas.get(area, 0) + tt
+        if filename != '~':
+            short = os.path.join(*parts[-2:]) if parts[-1] == '__init__.py' else parts[-1]
+            func = '%s:%d(%s)' % (short, line, func)
+        rows.append({'calls': nc, 'tottime': tt, 'cumtime': ct, 'function': func})
+    rows.sort(key=lambda r: (-r['cumtime'], r['function']))
+    return rows[:limit], areas
 
 class Renderer(object):
     def __init__(self, db):
         self.db = db
-    def render_lv_families(self):
+    @classmethod
+    def as_date(cls, value):
+        """A date, from a date or a YYYY-MM-DD string; None stays None."""
+        if value is None or isinstance(value, date):
+            return value
+        try:
+            return date(*map(int, value.split('-')))
+        except (ValueError, TypeError):
+            raise Exception("Bad date '%s', expected YYYY-MM-DD" % (value,))
+    def family_stats(self, start=None, end=None):
+        """The Database to draw family tables from: all of self.db, or just
+        the launches dated in [start, end)."""
+        if start is None and end is None:
+            return self.db
+        return self.db.between(self.as_date(start), self.as_date(end))
+    @classmethod
+    def date_range(cls, start=None, end=None):
+        if start is None and end is None:
+            return ''
+        return ' (%s to %s)' % (start or 'start', end or 'now')
+    @classmethod
+    def show_estimate(cls, rate):
+        if rate is None:
+            return '-'
+        return '%.1f%%' % (rate[0] * 100,)
+    @classmethod
+    def show_interval(cls, rate):
+        if rate is None:
+            return '-'
+        return '%.1f-%.1f%%' % (rate[1] * 100, rate[2] * 100)
+    RANKINGS = {'estimate': lambda (name, rate): (-rate[0], name),
+                'low': lambda (name, rate): (-rate[1], name),
+                'high': lambda (name, rate): (-rate[2], name),
+                'flights': lambda (name, rate): (-rate[3], name),
+                'name': lambda (name, rate): name}
+    def reliability_ranking(self, kind, sort='low'):
+        """[(name, (estimate, low, high, flights))] for each lv, stage or
+        engine (kind) with flights to judge by, best first by sort (one of
+        RANKINGS; by default, the low end of the interval)."""
+        if kind not in ('lv', 'stage', 'engine'):
+            raise Exception("No such kind '%s'" % (kind,))
+        if sort not in self.RANKINGS:
+            raise Exception("Can't sort by '%s'" % (sort,))
+        rates = [(name, rate) for name, rate in self.db.reliability(kind).items() if rate is not None]
+        return sorted(rates, key=self.RANKINGS[sort])
+    def render_lv_families(self, maxdepth, maxdest, start=None, end=None):
         raise NotImplementedError()
-    def render_stage_families(self, maxdepth, maxdest, vac=None):
+    def render_stage_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
         raise NotImplementedError()
-    def render_engine_families(self, maxdepth, maxdest, vac=None):
+    def render_engine_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
         raise NotImplementedError()
     def render_launches_per_year(self, maxdest):
         raise NotImplementedError()
+    def render_reliability(self, kind, sort='low'):
+        raise NotImplementedError()
+    CROSSTAB_HEADS = {'time': "Date", 'entity': "Name", 'dest': "Destination", 'result': "Result"}
+    def crosstab(self, time=None, entity=None, depth=0, dest=None, result=None, across=None):
+        """Database.crosstab (whose arguments may come as strings, from a
+        query), laid out for a table with the across grouping as columns.
+
+        Returns (groupings, columns, rows): the groupings down the side (of
+        'time', 'entity', 'dest' and 'result'), the values of the across
+        grouping (or just [None], for a single column), and for each row in
+        order, (its values of the groupings, {column: count})."""
+        depth = int(depth)
+        if dest is not None:
+            dest = int(dest)
+        result = result not in (None, False, '', '0')
+        table = self.db.crosstab(time, entity, depth, dest, result)
+        grouped = [g for g, on in (('time', time), ('entity', entity), ('dest', dest is not None), ('result', result)) if on]
+        if across is not None and across not in grouped:
+            raise Exception("Can't put '%s' across, as it is not grouped by" % (across,))
+        sort = {'time': lambda v: v, 'entity': lambda v: v,
+                'dest': lambda d: d.sort, 'result': self.db.RESULT_CLASSES.index}
+        position = dict(time=0, entity=1, dest=2, result=3)
+        down = [g for g in grouped if g != across]
+        columns = [None]
+        if across is not None:
+            columns = sorted(set(key[position[across]] for key in table), key=sort[across])
+        rows = {}
+        for key, n in table.items():
+            row = rows.setdefault(tuple(key[position[g]] for g in down), {})
+            column = key[position[across]] if across is not None else None
+            row[column] = row.get(column, 0) + n
+        order = lambda values: tuple(sort[g](v) for g, v in zip(down, values))
+        return down, columns, [(values, rows[values]) for values in sorted(rows, key=order)]
 
 class TextRenderer(Renderer):
-    def table(self, cols, rows):
-        for c in cols:
-            c['width'] = len(c['head'])
-        def fmt(r, c):
-            return c.get('formatter', str)(r[c['key']])
-        for r in rows:
-            for c in cols:
-                if c['key'] in r:
-                    c['width'] = max(c['width'], len(fmt(r, c)))
-        head = ''
-        for c in cols:
-            head += ' %s |' % (c['head'].ljust(c['width']),)
-        body = ''
-        rows = rows + ['=']
+    def __init__(self, db, out=None):
+        """If out (a file) is given, rendered text is written to it a line at
+        a time, and the render methods return None."""
+        Renderer.__init__(self, db)
+        self.out = out
+    def emit(self, lines):
+        if self.out is None:
+            return '\n'.join(lines)
+        for line in lines:
+            self.out.write(line + '\n')
+    def table_lines(self, cols, rows):
+        """The lines of a table of rows (dicts, or a character to rule
+        across), in columns of the widest of their cells.
+
+        Each cell is formatted once.  The widths depend on every row, so
+        nothing is yielded until all the rows have been formatted, and their
+        cells are kept (as strings) until then.  If every column declares
+        its 'width', though, each line is yielded as soon as its row is
+        formatted, and nothing is kept; a cell wider than its column pushes
+        the rest of its line along."""
+        formatters = [(c['key'], c.get('formatter', str)) for c in cols]
+        def line(r, widths):
+            if isinstance(r, str):
+                return ''.join('%s|' % (r * (w + 2),) for w in widths)
+            return ''.join(' %s |' % (cell.ljust(w),) for cell, w in zip(r, widths))
+        def head(widths):
+            return ''.join(' %s |' % (c['head'].ljust(w),) for c, w in zip(cols, widths))
+        if all('width' in c for c in cols):
+            widths = [max(len(c['head']), c['width']) for c in cols]
+            yield head(widths)
+            for r in rows:
+                if not isinstance(r, str):
+                    r = [fmt(r[key]) for key, fmt in formatters]
+                yield line(r, widths)
+            yield line('=', widths)
+            return
+        widths = [len(c['head']) for c in cols]
+        cells = []
         for r in rows:
-            body += '\n'
-            for c in cols:
-                if isinstance(r, str):
-                    field = r * (c['width'] + 2)
-                    body += '%s|' % (field,)
-                else:
-                    field = fmt(r, c).ljust(c['width'])
-                    body += ' %s |' % (field,)
-        return head + body
-    def render_lv_families(self, maxdepth, maxdest):
-        dests = self.db.coalesce_dests(self.db.lvs.values(), maxdest)
+            if not isinstance(r, str):
+                r = [fmt(r[key]) for key, fmt in formatters]
+                widths = [max(w, len(cell)) for w, cell in zip(widths, r)]
+            cells.append(r)
+        cells.append('=')
+        yield head(widths)
+        for r in cells:
+            yield line(r, widths)
+    def table(self, cols, rows):
+        return self.emit(self.table_lines(cols, rows))
+    def render_lv_families(self, maxdepth, maxdest, start=None, end=None):
+        db = self.family_stats(start, end)
+        dests = db.coalesce_dests(db.lvs.values(), maxdest)
+        columns = db.dest_columns(dests)
         def render_dest(dest):
+            count = db.count_dests(dest, columns)
             def render_d(d):
-                c = sum(dest.get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                c = count.get(d, 0)
                 s = str(c) if c else '-'
                 return s.rjust(max(len(d.abbr), 2))
             return ' '.join(map(render_d, dests))
@@ -571,27 +1933,34 @@ class TextRenderer(Renderer):
                 {'head': 'Succ', 'key': 'success'},
                 {'head': 'fSta', 'key': 'failure'},
                 {'head': 'fMis', 'key': 'mission_failure'},
+                {'head': 'Rel', 'key': 'reliability', 'formatter': self.show_estimate},
+                {'head': '95% CI', 'key': 'reliability', 'formatter': self.show_interval},
                 {'head': desthead, 'key': 'dest', 'formatter': render_dest}]
-        tree = self.db.lv_family_tree
+        tree = db.lv_family_tree
         rows = []
-        lv = dict((name, self.db.lv_family(name)) for name in self.db.lvs)
+        lv = db.lv_families
+        rel = db.reliability('lv')
         odepth = 0
-        for name, depth in self.db.counted_flatten_tree(tree, lv):
+        for name, depth in db.counted_flatten_tree(tree, lv):
             if depth < maxdepth:
                 if not depth:
                     rows.append('=')
                 elif not odepth:
                     rows.append('-')
                 row = dict(lv[name])
+                row['reliability'] = rel[name]
                 row['name'] = ' ' * depth + row['lv'].name
                 rows.append(row)
                 odepth = depth
         return self.table(cols, rows)
-    def render_stage_families(self, maxdepth, maxdest, vac=None):
-        dests = self.db.coalesce_dests(self.db.stages.values(), maxdest)
+    def render_stage_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
+        db = self.family_stats(start, end)
+        dests = db.coalesce_dests(db.stages.values(), maxdest)
+        columns = db.dest_columns(dests)
         def render_dest(dest):
+            count = db.count_dests(dest, columns)
             def render_d(d):
-                c = sum(dest.get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                c = count.get(d, 0)
                 s = str(c) if c else '-'
                 return s.rjust(max(len(d.abbr), 2))
             return ' '.join(map(render_d, dests))
@@ -608,14 +1977,17 @@ class TextRenderer(Renderer):
                 {'head': 'fSta', 'key': 'failure'},
                 {'head': 'fLwr', 'key': 'lower_failure'},
                 {'head': 'fMis', 'key': 'mission_failure'},
+                {'head': 'Rel', 'key': 'reliability', 'formatter': self.show_estimate},
+                {'head': '95% CI', 'key': 'reliability', 'formatter': self.show_interval},
                 {'head': desthead, 'key': 'dest', 'formatter': render_dest}]
-        tree = self.db.stage_family_tree
+        tree = db.stage_family_tree
         rows = []
-        st = dict((name, self.db.stage_family(name)) for name in self.db.stages)
+        st = db.stage_families
+        rel = db.reliability('stage')
         odepth = 0
         if maxdepth <= 1:
             rows.append('=')
-        for name, depth in self.db.counted_flatten_tree(tree, st):
+        for name, depth in db.counted_flatten_tree(tree, st):
             if depth < maxdepth and (vac is None or st[name]['stage'].vac == vac):
                 if maxdepth > 1:
                     if not depth:
@@ -623,15 +1995,19 @@ class TextRenderer(Renderer):
                     elif not odepth:
                         rows.append('-')
                 row = dict(st[name])
+                row['reliability'] = rel[name]
                 row['name'] = ' ' * depth + row['stage'].name
                 rows.append(row)
                 odepth = depth
         return self.table(cols, rows)
-    def render_engine_families(self, maxdepth, maxdest, vac=None):
-        dests = self.db.coalesce_dests(self.db.engines.values(), maxdest)
+    def render_engine_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
+        db = self.family_stats(start, end)
+        dests = db.coalesce_dests(db.engines.values(), maxdest)
+        columns = db.dest_columns(dests)
         def render_dest(dest):
+            count = db.count_dests(dest, columns)
             def render_d(d):
-                c = sum(dest.get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                c = count.get(d, 0)
                 s = str(c) if c else '-'
                 return s.rjust(max(len(d.abbr), 2))
             return ' '.join(map(render_d, dests))
@@ -643,14 +2019,17 @@ class TextRenderer(Renderer):
                 {'head': 'fSta', 'key': 'failure'},
                 {'head': 'fLwr', 'key': 'lower_failure'},
                 {'head': 'fMis', 'key': 'mission_failure'},
+                {'head': 'Rel', 'key': 'reliability', 'formatter': self.show_estimate},
+                {'head': '95% CI', 'key': 'reliability', 'formatter': self.show_interval},
                 {'head': desthead, 'key': 'dest', 'formatter': render_dest}]
-        tree = self.db.engine_family_tree
+        tree = db.engine_family_tree
         rows = []
-        en = dict((name, self.db.engine_family(name)) for name in self.db.engines)
+        en = db.engine_families
+        rel = db.reliability('engine')
         odepth = 0
         if maxdepth <= 1:
             rows.append('=')
-        for name, depth in self.db.counted_flatten_tree(tree, en):
+        for name, depth in db.counted_flatten_tree(tree, en):
             if depth < maxdepth and (vac is None or en[name]['engine'].vac == vac):
                 if maxdepth > 1:
                     if not depth:
@@ -658,15 +2037,18 @@ class TextRenderer(Renderer):
                     elif not odepth:
                         rows.append('-')
                 row = dict(en[name])
+                row['reliability'] = rel[name]
                 row['name'] = ' ' * depth + row['engine'].name
                 rows.append(row)
                 odepth = depth
         return self.table(cols, rows)
     def render_launches_per_year(self, maxdest):
         dests = self.db.coalesce_dests(self.db.lvs.values(), maxdest)
+        columns = self.db.dest_columns(dests)
         def render_dest(dest):
+            count = self.db.count_dests(dest, columns)
             def render_d(d):
-                c = sum(dest.get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                c = count.get(d, 0)
                 s = str(c) if c else '-'
                 return s.rjust(max(len(d.abbr), 2))
             return ' '.join(map(render_d, dests))
@@ -676,12 +2058,51 @@ class TextRenderer(Renderer):
                 {'head': desthead, 'key': 'dest', 'formatter': render_dest}]
         rows = ['=']
         for year, launches in sorted(self.db.launches_by_year.items()):
-            launches = [l for l in launches if l.result != -2]
+            launches = [l for l in launches if l.status.flew]
             row = {'year': year, 'count': len(launches), 'dest': {}}
             for launch in launches:
                 row['dest'][launch.dest] = row['dest'].get(launch.dest, 0) + 1
             rows.append(row)
         return self.table(cols, rows)
+    def render_reliability(self, kind, sort='low'):
+        pct = lambda v: '%.1f%%' % (v * 100,)
+        cols = [{'head': 'Rank', 'key': 'rank'},
+                {'head': 'Name', 'key': 'name'},
+                {'head': 'Flights', 'key': 'flights'},
+                {'head': 'Est.', 'key': 'estimate', 'formatter': pct},
+                {'head': 'Low', 'key': 'low', 'formatter': pct},
+                {'head': 'High', 'key': 'high', 'formatter': pct}]
+        rows = ['=']
+        for i, (name, (estimate, low, high, flights)) in enumerate(self.reliability_ranking(kind, sort)):
+            rows.append({'rank': i + 1, 'name': name, 'flights': flights, 'estimate': estimate, 'low': low, 'high': high})
+        return self.table(cols, rows)
+    def render_crosstab(self, time='year', entity=None, depth=0, dest=None, result=None, across=None):
+        down, columns, rows = self.crosstab(time, entity, depth, dest, result, across)
+        show = {'time': str, 'entity': str, 'dest': lambda d: d.abbr, 'result': str}
+        cols = [{'head': self.CROSSTAB_HEADS[g], 'key': g, 'formatter': show[g]} for g in down]
+        heads = [show[across](c) if across else "Launches" for c in columns]
+        cols.extend({'head': head, 'key': i, 'formatter': lambda n: str(n or '-')} for i, head in enumerate(heads))
+        if across:
+            cols.append({'head': "Total", 'key': 'total'})
+        table = ['=']
+        for values, counts in rows:
+            row = dict(zip(down, values))
+            row.update((i, counts.get(c)) for i, c in enumerate(columns))
+            row['total'] = sum(counts.values())
+            table.append(row)
+        return self.table(cols, table)
+    def render_profile(self, fn, limit=30):
+        rows, areas = profile_summary(fn, limit)
+        secs = lambda v: '%.4f' % (v,)
+        cols = [{'head': 'Calls', 'key': 'calls'},
+                {'head': 'Own time', 'key': 'tottime', 'formatter': secs},
+                {'head': 'Cumulative', 'key': 'cumtime', 'formatter': secs},
+                {'head': 'Function', 'key': 'function'}]
+        summary = self.table_lines(cols, rows)
+        cols = [{'head': 'Area', 'key': 'area'},
+                {'head': 'Own time', 'key': 'tottime', 'formatter': secs}]
+        rows = [{'area': a, 'tottime': areas[a]} for a in sorted(areas, key=areas.get, reverse=True)]
+        return self.emit(itertools.chain(summary, [''], self.table_lines(cols, rows)))
 
 class HtmlRenderer(Renderer):
     stylesheet = """
@@ -693,10 +2114,64 @@ class HtmlRenderer(Renderer):
         .major { font-weight: bold; border-top: 2px solid black; }
         .gallery td { text-align: center; width: 200px; }
     """
+    profiles = 'profiles' # directory of saved profiles, for render_profile
+    searchable = True # whether the index has a search form (export_site has no search page)
     def wrap_page(self, title, body):
         page = t.html[t.head[t.title[title + ' - Encyclopædia Kerbonautica'], t.style[self.stylesheet]],
                       t.body[t.h1[title], body]]
+        return self.flatten(page)
+    def flatten(self, page):
         return flatten(page)
+    chunk_size = 16384
+    def chunks(self, page):
+        """Flatten page a piece at a time: a generator of strings of about
+        chunk_size bytes, which only gets to (say) the rows of a table, and
+        anything generating them, as it reaches them.
+
+        The page is flattened with a placeholder for each generator in it,
+        and then each item a generator yields is flattened on its own."""
+        from nevow import tags as t
+        import types
+        generators = []
+        def hollow(node):
+            if isinstance(node, types.GeneratorType):
+                generators.append(node)
+                return t.raw('\0%d\0' % (len(generators) - 1,))
+            if isinstance(node, (list, tuple)):
+                return [hollow(n) for n in node]
+            if isinstance(getattr(node, 'children', None), list):
+                node.children = [hollow(n) for n in node.children]
+            return node
+        # the shell's text, with the number of each placeholder in between
+        shell = str(flatten(hollow(page))).split('\0')
+        pieces = []
+        size = 0
+        for i, part in enumerate(shell):
+            for text in (flatten(item) for item in generators[int(part)]) if i % 2 else [part]:
+                pieces.append(text)
+                size += len(text)
+                if size >= self.chunk_size:
+                    yield ''.join(pieces)
+                    pieces = []
+                    size = 0
+        yield ''.join(pieces)
+    def render_index(self):
+        page = t.html[t.head[t.title['Encyclopædia Kerbonautica']],
+                      t.body[t.h1['Encyclopædia Kerbonautica'],
+                             t.ul[t.li[t.a(href='lpy')['Launches per year']],
+                                  t.li[t.a(href='lvf')['Launch-vehicle families']],
+                                  t.li[t.a(href='bsf')['Booster stages']],
+                                  t.li[t.a(href='vsf')['Upper stages']],
+                                  t.li[t.a(href='bef')['Atmospheric engines']],
+                                  t.li[t.a(href='vef')['Vacuum engines']],
+                                  t.li[t.a(href='lvr')['LV reliability']],
+                                  t.li[t.a(href='sr')['Stage reliability']],
+                                  t.li[t.a(href='er')['Engine reliability']],
+                                  t.li[t.a(href='flights')['Aircraft flights']],
+                                  ],
+                             self.search_form() if self.searchable else [],
+                             ]]
+        return self.flatten(page)
     def show_dest(self, dest):
         return t.acronym(title="%s: %s" % (dest.name, dest.description))[dest.abbr]
     def show_payload(self, payload):
@@ -707,60 +2182,72 @@ class HtmlRenderer(Renderer):
         else:
             return payload.name
         return t.a(href=url)[payload.name]
-    def table_lv_families(self, maxdepth, maxdest, root=None):
+    def table_lv_families(self, maxdepth, maxdest, root=None, start=None, end=None):
+        db = self.family_stats(start, end)
         if root:
-            tree = {root: self.db.lv_tree[root]}
+            tree = {root: db.lv_tree[root]}
         else:
-            tree = self.db.lv_family_tree
-        lvs = dict((name, self.db.lv_family(name)) for name in self.db.lvs)
-        dests = self.db.coalesce_dests(map(self.db.lv_family, self.db.flatten_tree(tree)), maxdest)
-        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=2)["Failed"], t.th(rowspan=2)["T-0 Scrub"], t.th(colspan=len(dests))["Destinations"]]
-        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Mission"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
+            tree = db.lv_family_tree
+        lvs = db.lv_families
+        rel = db.reliability('lv')
+        dests = db.coalesce_dests(map(db.lv_family, db.flatten_tree(tree)), maxdest)
+        columns = db.dest_columns(dests)
+        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=2)["Failed"], t.th(rowspan=2)["T-0 Scrub"], t.th(colspan=2)["Reliability"], t.th(colspan=len(dests))["Destinations"]]
+        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Mission"], t.th["Est."], t.th["95% CI"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
         rows = []
-        for name, depth in self.db.counted_flatten_tree(tree, lvs):
+        for name, depth in db.counted_flatten_tree(tree, lvs):
             if depth < maxdepth:
                 lv = lvs[name]
+                rate = rel[name]
+                count = db.count_dests(lv['dest'], columns)
                 def render_d(d):
-                    c = sum(lv['dest'].get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                    c = count.get(d, 0)
                     return str(c) if c else '-'
                 name = lv['lv'].name
                 rows.append(t.tr(Class='' if depth else 'major')[
-                        t.td[[nevow.entities.nbsp] * depth, t.a(href='lv?name='+urllib.quote(name))[name]],
+                        t.td[[entities.nbsp] * depth, t.a(href='lv?name='+urllib.quote(name))[name]],
                         t.td(Class='date')[lv['first'].isoformat()],
                         t.td(Class='date')[lv['last'].isoformat()],
                         t.td(Class='num')[str(lv['success'] or '-')],
                         t.td(Class='num')[str(lv['failure'] or '-')],
                         t.td(Class='num')[str(lv['mission_failure'] or '-')],
                         t.td(Class='num')[str(lv['scrub'] or '-')],
+                        t.td(Class='num')[self.show_estimate(rate)],
+                        t.td(Class='num')[self.show_interval(rate)],
                         [t.td(Class='num')[render_d(d)] for d in dests],
                         ])
         return t.table[head1, head2, rows]
-    def render_lv_families(self, maxdepth, maxdest):
-        return self.wrap_page("LV families", self.table_lv_families(maxdepth, maxdest))
-    def table_stage_families(self, maxdepth, maxdest, vac=None, root=None):
+    def render_lv_families(self, maxdepth, maxdest, start=None, end=None):
+        return self.wrap_page("LV families" + self.date_range(start, end), self.table_lv_families(maxdepth, maxdest, start=start, end=end))
+    def table_stage_families(self, maxdepth, maxdest, vac=None, root=None, start=None, end=None):
+        db = self.family_stats(start, end)
         if root:
-            tree = {root: self.db.stage_tree[root]}
+            tree = {root: db.stage_tree[root]}
         else:
-            tree = self.db.stage_family_tree
-        dests = self.db.coalesce_dests(map(self.db.stage_family, self.db.flatten_tree(tree)), maxdest)
-        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(rowspan=2)["Engine"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=3)["Failed"], t.th(colspan=len(dests))["Destinations"]]
-        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Lower"], t.th["Mission"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
+            tree = db.stage_family_tree
+        dests = db.coalesce_dests(map(db.stage_family, db.flatten_tree(tree)), maxdest)
+        columns = db.dest_columns(dests)
+        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(rowspan=2)["Engine"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=3)["Failed"], t.th(colspan=2)["Reliability"], t.th(colspan=len(dests))["Destinations"]]
+        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Lower"], t.th["Mission"], t.th["Est."], t.th["95% CI"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
         rows = []
-        stages = dict((name, self.db.stage_family(name)) for name in self.db.stages)
+        stages = db.stage_families
+        rel = db.reliability('stage')
         def render_engine(st):
             eng = t.a(href='engine?name='+urllib.quote(st.engine.name))[st.engine.name]
             if st.engine_count > 1:
                 eng = ['%dx ' % (st.engine_count,), eng]
             return eng
-        for name, depth in self.db.counted_flatten_tree(tree, stages):
+        for name, depth in db.counted_flatten_tree(tree, stages):
             st = stages[name]
+            rate = rel[name]
             if depth < maxdepth and (vac is None or st['stage'].vac == vac):
+                count = db.count_dests(st['dest'], columns)
                 def render_d(d):
-                    c = sum(st['dest'].get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                    c = count.get(d, 0)
                     return str(c or '-')
                 name = st['stage'].name
                 rows.append(t.tr(Class='' if depth else 'major')[
-                        t.td[[nevow.entities.nbsp] * depth, t.a(href='stage?name='+urllib.quote(name))[name]],
+                        t.td[[entities.nbsp] * depth, t.a(href='stage?name='+urllib.quote(name))[name]],
                         t.td[render_engine(st['stage'])],
                         t.td(Class='date')[st['first'].isoformat()],
                         t.td(Class='date')[st['last'].isoformat()],
@@ -768,82 +2255,138 @@ class HtmlRenderer(Renderer):
                         t.td(Class='num')[str(st['failure'] or '-')],
                         t.td(Class='num')[str(st['lower_failure'] or '-')],
                         t.td(Class='num')[str(st['mission_failure'] or '-')],
+                        t.td(Class='num')[self.show_estimate(rate)],
+                        t.td(Class='num')[self.show_interval(rate)],
                         [t.td(Class='num')[render_d(d)] for d in dests],
                         ])
         return t.table[head1, head2, rows]
-    def render_stage_families(self, maxdepth, maxdest, vac=None):
+    def render_stage_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
         title = {None: "Stage families", False: "Booster stages", True: "Upper stages"}.get(vac)
-        return self.wrap_page(title, self.table_stage_families(maxdepth, maxdest, vac=vac))
-    def table_engine_families(self, maxdepth, maxdest, vac=None, root=None):
+        return self.wrap_page(title + self.date_range(start, end), self.table_stage_families(maxdepth, maxdest, vac=vac, start=start, end=end))
+    def table_engine_families(self, maxdepth, maxdest, vac=None, root=None, start=None, end=None):
+        db = self.family_stats(start, end)
         if root:
-            tree = {root: self.db.engine_tree[root]}
+            tree = {root: db.engine_tree[root]}
         else:
-            tree = self.db.engine_family_tree
-        dests = self.db.coalesce_dests(map(self.db.engine_family, self.db.flatten_tree(tree)), maxdest)
-        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=3)["Failed"], t.th(colspan=len(dests))["Destinations"]]
-        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Lower"], t.th["Mission"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
+            tree = db.engine_family_tree
+        dests = db.coalesce_dests(map(db.engine_family, db.flatten_tree(tree)), maxdest)
+        columns = db.dest_columns(dests)
+        head1 = t.tr[t.th(rowspan=2)["Name"], t.th(colspan=2)["Flight dates"], t.th(rowspan=2)["Success"], t.th(colspan=3)["Failed"], t.th(colspan=2)["Reliability"], t.th(colspan=len(dests))["Destinations"]]
+        head2 = t.tr[t.th["First"], t.th["Last"], t.th["Stage"], t.th["Lower"], t.th["Mission"], t.th["Est."], t.th["95% CI"], [t.th(Class='num')[self.show_dest(d)] for d in dests]]
         rows = []
-        engines = dict((name, self.db.engine_family(name)) for name in self.db.engines)
-        for name, depth in self.db.counted_flatten_tree(tree, engines):
+        engines = db.engine_families
+        rel = db.reliability('engine')
+        for name, depth in db.counted_flatten_tree(tree, engines):
             en = engines[name]
+            rate = rel[name]
             if depth < maxdepth and (vac is None or en['engine'].vac == vac):
+                count = db.count_dests(en['dest'], columns)
                 def render_d(d):
-                    c = sum(en['dest'].get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                    c = count.get(d, 0)
                     return str(c) if c else '-'
                 name = en['engine'].name
                 rows.append(t.tr(Class='' if depth else 'major')[
-                        t.td[[nevow.entities.nbsp] * depth, t.a(href='engine?name='+urllib.quote(name))[name]],
+                        t.td[[entities.nbsp] * depth, t.a(href='engine?name='+urllib.quote(name))[name]],
                         t.td(Class='date')[en['first'].isoformat()],
                         t.td(Class='date')[en['last'].isoformat()],
                         t.td(Class='num')[str(en['success'] or '-')],
                         t.td(Class='num')[str(en['failure'] or '-')],
                         t.td(Class='num')[str(en['lower_failure'] or '-')],
                         t.td(Class='num')[str(en['mission_failure'] or '-')],
+                        t.td(Class='num')[self.show_estimate(rate)],
+                        t.td(Class='num')[self.show_interval(rate)],
                         [t.td(Class='num')[render_d(d)] for d in dests],
                         ])
         return t.table[head1, head2, rows]
-    def render_engine_families(self, maxdepth, maxdest, vac=None):
+    def render_engine_families(self, maxdepth, maxdest, vac=None, start=None, end=None):
         title = {None: "Engine families", False: "Atmospheric engines", True: "Vacuum engines"}.get(vac)
-        return self.wrap_page(title, self.table_engine_families(maxdepth, maxdest, vac=vac))
+        return self.wrap_page(title + self.date_range(start, end), self.table_engine_families(maxdepth, maxdest, vac=vac, start=start, end=end))
+    reliability_pages = {'lv': 'lvr', 'stage': 'sr', 'engine': 'er'}
+    def render_reliability(self, kind, sort='low'):
+        ranking = self.reliability_ranking(kind, sort)
+        title = {'lv': "LV reliability", 'stage': "Stage reliability", 'engine': "Engine reliability"}[kind]
+        def head(label, key, rowspan=1):
+            if key == sort:
+                return t.th(rowspan=rowspan)[label]
+            return t.th(rowspan=rowspan)[t.a(href='%s?sort=%s' % (self.reliability_pages[kind], key))[label]]
+        pct = lambda v: '%.1f%%' % (v * 100,)
+        rows = []
+        for i, (name, (estimate, low, high, flights)) in enumerate(ranking):
+            rows.append(t.tr[t.td(Class='num')[str(i + 1)],
+                             t.td[t.a(href='%s?name=%s' % (kind, urllib.quote(name)))[name]],
+                             t.td(Class='num')[str(flights)],
+                             t.td(Class='num')[pct(estimate)],
+                             t.td(Class='num')[pct(low)],
+                             t.td(Class='num')[pct(high)]])
+        head1 = t.tr[t.th(rowspan=2)["Rank"], head("Name", 'name', 2), head("Flights", 'flights', 2), head("Estimate", 'estimate', 2), t.th(colspan=2)["95% interval"]]
+        head2 = t.tr[head("Low", 'low'), head("High", 'high')]
+        note = t.p["Share of flights on which each one (with its family members) did its part, and the Wilson score interval around it.  Families are ranked alongside their members; by default, by the low end of the interval, so that a short record does not rank above a long one."]
+        return self.wrap_page(title, [note, t.table[head1, head2, rows]])
+    def render_crosstab(self, time='year', entity=None, depth=0, dest=None, result=None, across=None):
+        down, columns, rows = self.crosstab(time, entity, depth, dest, result, across)
+        pages = {'lv': 'lv', 'stage': 'stage', 'engine': 'engine'}
+        def show(grouping, value):
+            if grouping == 'dest':
+                return self.show_dest(value)
+            if grouping == 'entity':
+                return t.a(href='%s?name=%s' % (pages[entity], urllib.quote(value)))[value]
+            return value
+        head = t.tr[[t.th[self.CROSSTAB_HEADS[g]] for g in down],
+                    [t.th(Class='num')[show(across, c) if across else "Launches"] for c in columns],
+                    t.th(Class='num')["Total"] if across else []]
+        trs = []
+        for values, counts in rows:
+            trs.append(t.tr[[t.td[show(g, v)] for g, v in zip(down, values)],
+                            [t.td(Class='num')[str(counts.get(c) or '-')] for c in columns],
+                            t.td(Class='num')[str(sum(counts.values()))] if across else []])
+        grouping = ', '.join(self.CROSSTAB_HEADS[g].lower() for g in down + ([across] if across else []))
+        title = "Launches by %s" % (grouping,) if grouping else "Launches"
+        return self.wrap_page(title, t.table[head, trs])
     def render_launches_per_year(self, maxdest):
         dests = self.db.coalesce_dests(self.db.lvs.values(), maxdest)
+        columns = self.db.dest_columns(dests)
         head1 = t.tr[t.th(rowspan=2)["Year"], t.th(rowspan=2)["Launches"], t.th(colspan=len(dests))["By destination"]]
         head2 = t.tr[[t.th[self.show_dest(d)] for d in dests]]
         rows = []
         for year, launches in sorted(self.db.launches_by_year.items()):
             by_dest = {}
-            launches = [l for l in launches if l.result != -2]
+            launches = [l for l in launches if l.status.flew]
             for launch in launches:
                 by_dest[launch.dest] = by_dest.get(launch.dest, 0) + 1
+            count = self.db.count_dests(by_dest, columns)
             def render_d(d):
-                c = sum(by_dest.get(n, 0) for n in self.db.dest_tree.keys() if n.member(d) and (n == d or n not in dests))
+                c = count.get(d, 0)
                 return str(c) if c else '-'
             rows.append(t.tr[t.td(Class='date')[t.a(href='year?year=%d'%(year,))[year]], t.td(Class='num')[len(launches)], [t.td(Class='num')[render_d(d)] for d in dests]])
         tbl = t.table[head1, head2, rows]
         return self.wrap_page("Launches per year", tbl)
     @classmethod
     def render_result(cls, result):
-        if isinstance(result, tuple):
-            return [cls.render_result(result[0]), ' + stage %s failure' % (', '.join(map(str, result[1:])),)]
-        if result == 0:
-            return 'Success'
-        if result == -2:
-            return t.acronym(title="A failure occurred before launch clamps were released, so the launch attempt was abandoned and the vehicle rolled back.")['T-0 Scrub']
-        if result < 0:
-            return 'Mission Failure'
-        return 'Stage %d Failure' % (result,)
-    def table_launch_history(self, **kwargs):
+        status = Result.of(result)
+        if status.outcome == Result.STAGE_FAILURE:
+            shown = 'Stage %d Failure' % (status.stage,)
+        elif status.outcome == Result.SCRUB:
+            shown = t.acronym(title="A failure occurred before launch clamps were released, so the launch attempt was abandoned and the vehicle rolled back.")['T-0 Scrub']
+        else:
+            shown = ('Success', 'Mission Failure')[status.outcome]
+        if status.extra:
+            return [shown, ' + stage %s failure' % (', '.join(map(str, status.extra)),)]
+        return shown
+    def launch_row(self, launch):
+        return t.tr[t.td[t.a(href='launch?name='+urllib.quote(launch.name))[launch.name]],
+                    t.td(Class='date')[launch.date.isoformat()],
+                    t.td[t.a(href='lv?name='+urllib.quote(launch.lv.name))[launch.lv.name]],
+                    t.td[self.show_payload(launch.payload)],
+                    t.td[t.acronym(title=launch.dest.description)[launch.dest.name]],
+                    t.td[self.render_result(launch.result)],
+                    ]
+    def table_launches(self, launches):
         head = t.tr[t.th["Name"], t.th["Date"], t.th["LV"], t.th["Payload"], t.th["Destination"], t.th["Result"]]
-        rows = []
-        for launch in self.db.filter_launches(**kwargs):
-            rows.append(t.tr[t.td[t.a(href='launch?name='+urllib.quote(launch.name))[launch.name]],
-                             t.td(Class='date')[launch.date.isoformat()],
-                             t.td[t.a(href='lv?name='+urllib.quote(launch.lv.name))[launch.lv.name]],
-                             t.td[self.show_payload(launch.payload)],
-                             t.td[t.acronym(title=launch.dest.description)[launch.dest.name]],
-                             t.td[self.render_result(launch.result)],
-                             ])
+        # rows are only built as the table is flattened (see chunks())
+        rows = (self.launch_row(launch) for launch in launches)
         return t.table[head, rows]
+    def table_launch_history(self, **kwargs):
+        return self.table_launches(self.db.iter_launches(**kwargs))
     def launches_for_year(self, year=None):
         if year is None:
             raise Exception("No year specified")
@@ -863,7 +2406,7 @@ class HtmlRenderer(Renderer):
         if name not in self.db.lvs:
             raise Exception("No such LV '%s'"%(name,))
         lv = self.db.lvs[name]['lv']
-        lvs = dict((name, self.db.lv_family(name)) for name in self.db.lvs)
+        lvs = self.db.lv_families
         title = "LV '%s'"%(lv.name,)
         blocks = []
         if lv.family:
@@ -875,7 +2418,7 @@ class HtmlRenderer(Renderer):
         blocks.append(self.table_lv_families(2, 1, root=name))
         blocks.append(t.h2["Full Launch History"])
         blocks.append(self.table_launch_history(lv=name))
-        pics = [l.launch_pic for l in self.db.filter_launches(lv=name) if l.launch_pic is not None]
+        pics = [l.launch_pic for l in self.db.iter_launches(lv=name) if l.launch_pic is not None]
         if pics:
             blocks.append(t.h2["Image Gallery"])
             blocks.append(self.render_image_table(pics, 6, 200))
@@ -884,7 +2427,7 @@ class HtmlRenderer(Renderer):
         if name not in self.db.stages:
             raise Exception("No such stage '%s'"%(name,))
         st = self.db.stages[name]['stage']
-        sts = dict((name, self.db.stage_family(name)) for name in self.db.stages)
+        sts = self.db.stage_families
         title = "Stage '%s'"%(st.name,)
         blocks = []
         if st.family:
@@ -896,16 +2439,20 @@ class HtmlRenderer(Renderer):
         if st.engine_count > 1:
             eng = ['%d× ' % (st.engine_count,), eng]
         blocks.append(t.p[eng])
+        blocks.append(t.h2["Flown on the following LVs:"])
+        blocks.append(self.list_users('lv', self.db.used_by('stage', name, 'lv')))
         blocks.append(t.h2["Summary of Launches"])
         blocks.append(self.table_stage_families(2, 1, root=name))
         blocks.append(t.h2["Full Launch History"])
         blocks.append(self.table_launch_history(stage=name))
         return self.wrap_page(title, blocks)
+    def list_users(self, kind, names):
+        return t.ul[[t.li[t.a(href=kind+'?name='+urllib.quote(n))[n]] for n in names]]
     def render_engine_info(self, name=None):
         if name not in self.db.engines:
             raise Exception("No such engine '%s'"%(name,))
         en = self.db.engines[name]['engine']
-        ens = dict((name, self.db.engine_family(name)) for name in self.db.engines)
+        ens = self.db.engine_families
         title = "Engine '%s'"%(en.name,)
         blocks = []
         if en.family:
@@ -913,8 +2460,9 @@ class HtmlRenderer(Renderer):
         blocks.append(t.p["Vacuum engine." if en.vac else "Atmospheric engine."])
         blocks.append(t.p[en.description])
         blocks.append(t.h2["Used in the following stages:"])
-        stages = [k for k,v in self.db.stages.items() if v['stage'].engine == en]
-        blocks.append(t.ul[[t.li[t.a(href='stage?name='+urllib.quote(st))[st]] for st in stages]])
+        blocks.append(self.list_users('stage', self.db.used_by('engine', name, 'stage')))
+        blocks.append(t.h2["Flown on the following LVs:"])
+        blocks.append(self.list_users('lv', self.db.used_by('engine', name, 'lv')))
         blocks.append(t.h2["Summary of Launches"])
         blocks.append(self.table_engine_families(2, 1, root=name))
         blocks.append(t.h2["Full Launch History"])
@@ -954,6 +2502,9 @@ class HtmlRenderer(Renderer):
             blocks.append(t.p['Date: ', date.isoformat(payload.launch.date)])
             blocks.append(t.p['Destination: ', t.acronym(title=payload.launch.dest.description)[payload.launch.dest.name]])
             blocks.append(t.p['Result: ', self.render_result(payload.launch.result)])
+            crew = self.db.crew_of(payload.launch)
+            if crew:
+                blocks.append(t.p['Crew: ', self.show_crew(crew)])
             blocks.append(t.p[payload.launch.comments])
         if payload.pics:
             pics = list(payload.pics)
@@ -971,21 +2522,24 @@ class HtmlRenderer(Renderer):
                   t.p['Vehicle: ', t.a(href='lv?name='+urllib.quote(launch.lv.name))[launch.lv.name]],
                   t.p['Payload: ', self.show_payload(launch.payload)],
                   t.p['Destination: ', t.acronym(title=launch.dest.description)[launch.dest.name]],
-                  t.p['Result: ', self.render_result(launch.result)],
-                  t.p[launch.comments]]
+                  t.p['Result: ', self.render_result(launch.result)]]
+        crew = self.db.crew_of(launch)
+        if crew:
+            blocks.append(t.p['Crew: ', self.show_crew(crew)])
+        blocks.append(t.p[launch.comments])
         if launch.pics:
             blocks.append(t.h2["Image Gallery"])
             blocks.append(self.render_image_table(launch.pics, 6, 200))
         return self.wrap_page(title, blocks)
+    def flight_row(self, flight):
+        return t.tr[t.td[t.a(href='flight?name='+urllib.quote(flight.name))[flight.name]],
+                    t.td(Class='date')[flight.date.isoformat()],
+                    t.td[t.a(href='flights?ac='+urllib.quote(flight.ac))[flight.ac]],
+                    t.td[flight.comments or ''],
+                    ]
     def table_flight_history(self, flights):
         head = t.tr[t.th["Name"], t.th["Date"], t.th["Aircraft"], t.th["Comments"]]
-        rows = []
-        for flight in flights:
-            rows.append(t.tr[t.td[t.a(href='flight?name='+urllib.quote(flight.name))[flight.name]],
-                             t.td(Class='date')[flight.date.isoformat()],
-                             t.td[t.a(href='flights?ac='+urllib.quote(flight.ac))[flight.ac]],
-                             t.td[flight.comments or ''],
-                             ])
+        rows = (self.flight_row(flight) for flight in flights)
         return t.table[head, rows]
     def render_flights(self, **kwargs):
         title = "Aircraft Flights"
@@ -995,7 +2549,7 @@ class HtmlRenderer(Renderer):
         if 'ac' in kwargs:
             body.append(t.p["by ", kwargs['ac']])
         if 'crew' in kwargs:
-            body.append(t.p["with ", kwargs['crew']])
+            body.append(t.p["with ", self.show_person(kwargs['crew'])])
         if 'year' in kwargs:
             body.append(t.p["during ", kwargs['year']])
         body.append(self.table_flight_history(flights))
@@ -1008,16 +2562,87 @@ class HtmlRenderer(Renderer):
             raise Exception("No such flight '%s'"%(name,))
         flight = self.db.flights_by_name[name]
         title = "Flight '%s'"%(flight.name,)
-        def render_crew(name):
-            return t.a(href='flights?crew='+urllib.quote(name))[name]
         blocks = [t.p['Date: ', date.isoformat(flight.date)],
                   t.p['Vehicle: ', t.a(href='flights?ac='+urllib.quote(flight.ac))[flight.ac]],
-                  t.h3['Crew'], t.ul[[t.li[render_crew(name)] for name in flight.crew]],
+                  t.h3['Crew'], t.ul[[t.li[self.show_person(name)] for name in flight.crew]],
                   t.p[flight.comments or '']]
         if flight.pics:
             blocks.append(t.h2["Image Gallery"])
             blocks.append(self.render_image_table(flight.pics, 6, 200))
         return self.wrap_page(title, blocks)
+    def show_person(self, name):
+        return t.a(href='person?name='+urllib.quote(name))[name]
+    def show_crew(self, crew):
+        return [[', ' if i else '', self.show_person(member)] for i, member in enumerate(crew)]
+    def render_person(self, name=None):
+        person = self.db.person(name)
+        title = "Crew member '%s'"%(name,)
+        blocks = [t.p['Flights: %d' % (len(person['flights']),)],
+                  t.p['Launches: %d (%d successful)' % (person['flown'], person['success'])]]
+        if 'first' in person:
+            blocks.append(t.p['Career: ', person['first'].isoformat(), ' to ', person['last'].isoformat()])
+        if person['launches']:
+            blocks.append(t.h2["Launches"])
+            # a copy, as the career may change while the page is streamed
+            blocks.append(self.table_launches(list(person['launches'])))
+        if person['flights']:
+            blocks.append(t.h2["Flights"])
+            blocks.append(self.table_flight_history(list(person['flights'])))
+        return self.wrap_page(title, blocks)
+    search_limit = 100
+    def search_row(self, kind, item):
+        if kind == 'launch':
+            name = item.name
+            if self.db.launches_by_name.get(name) == item:
+                name = t.a(href='launch?name='+urllib.quote(name))[name]
+            details = [t.a(href='lv?name='+urllib.quote(item.lv.name))[item.lv.name], ': ', self.show_payload(item.payload), ' (', self.render_result(item.result), ')']
+        elif kind == 'flight':
+            name = t.a(href='flight?name='+urllib.quote(item.name))[item.name]
+            details = [t.a(href='flights?ac='+urllib.quote(item.ac))[item.ac], ': ', item.comments or '']
+        else:
+            name = t.a(href=kind+'?name='+urllib.quote(item.name))[item.name]
+            details = item.description
+        when = item.date.isoformat() if kind in ('launch', 'flight') else ''
+        return t.tr[t.td[kind.capitalize() if kind != 'lv' else 'LV'], t.td[name], t.td(Class='date')[when], t.td[details]]
+    def search_form(self, q=None):
+        field = t.input(name='q') if q is None else t.input(name='q', value=q)
+        return t.form(action='search')[field, t.input(type='submit', value='Search')]
+    def render_search(self, q=None):
+        title = "Search"
+        body = [self.search_form(q or '')]
+        if q:
+            found = self.db.search(q, self.search_limit + 1)
+            if not found:
+                body.append(t.p["No matches."])
+            else:
+                if len(found) > self.search_limit:
+                    body.append(t.p["Showing the best %d matches." % (self.search_limit,)])
+                    found = found[:self.search_limit]
+                head = t.tr[t.th["Kind"], t.th["Name"], t.th["Date"], t.th["Details"]]
+                body.append(t.table[head, [self.search_row(kind, item) for kind, item in found]])
+        return self.wrap_page(title, body)
+    def render_profile(self, name=None):
+        if name is None:
+            title = "Profiles"
+            names = [n for n in os.listdir(self.profiles) if n.endswith('.prof')] if os.path.isdir(self.profiles) else []
+            names.sort(key=lambda n: os.path.getmtime(os.path.join(self.profiles, n)), reverse=True)
+            return self.wrap_page(title, t.ul[[t.li[t.a(href='profile?name='+urllib.quote(n))[n]] for n in names]])
+        fn = os.path.join(self.profiles, name)
+        if os.path.basename(name) != name or not name.endswith('.prof') or not os.path.isfile(fn):
+            raise Exception("No such profile '%s'"%(name,))
+        rows, areas = profile_summary(fn)
+        title = "Profile '%s'"%(name,)
+        head = t.tr[t.th["Calls"], t.th["Own time"], t.th["Cumulative"], t.th["Function"]]
+        body = [t.p[t.a(href='profile')["All profiles"]],
+                t.h2["Top functions by cumulative time"],
+                t.table[head, [t.tr[t.td(Class='num')[str(r['calls'])],
+                                    t.td(Class='num')['%.4f' % (r['tottime'],)],
+                                    t.td(Class='num')['%.4f' % (r['cumtime'],)],
+                                    t.td[r['function']]] for r in rows]],
+                t.h2["Own time by area"],
+                t.table[t.tr[t.th["Area"], t.th["Own time"]],
+                        [t.tr[t.td[a], t.td(Class='num')['%.4f' % (areas[a],)]] for a in sorted(areas, key=areas.get, reverse=True)]]]
+        return self.wrap_page(title, body)
 
 def test_html(db):
     # Render HTML tables
@@ -1037,17 +2662,512 @@ def test_html(db):
         bef.write(html.render_engine_families(2, 1, False))
     with open('html/vef.html', 'w') as vef:
         vef.write(html.render_engine_families(2, 1, True))
+    for kind, page in html.reliability_pages.items():
+        with open('html/%s.html' % (page,), 'w') as rel:
+            rel.write(html.render_reliability(kind))
+
+class LRUCache(object):
+    """Mapping which forgets its least recently used entries once the total
+    size of its values (as measured by sizeof) exceeds max_size."""
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.entries = collections.OrderedDict()
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+    def put(self, key, value):
+        if key in self.entries:
+            self.size -= self.sizeof(self.entries.pop(key))
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        self.entries[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.size -= self.sizeof(old)
+    def __len__(self):
+        return len(self.entries)
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+class Metrics(object):
+    """Counters, gauges and latency histograms, exposed in the Prometheus
+    text format.
+
+    Recording is a dict update (and, for histograms, a bisect) under a lock,
+    so it is cheap enough to leave on, and safe from worker threads."""
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.help = {}
+        self.values = {} # (name, labels): number, or for histograms [per-bucket counts..., overflow, sum]
+    def describe(self, name, text):
+        self.help[name] = text
+    def _key(self, kind, name, labels):
+        self.kinds.setdefault(name, kind)
+        return (name, tuple(sorted(labels.items())))
+    def count(self, name, n=1, **labels):
+        key = self._key('counter', name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+    def gauge(self, name, value, **labels):
+        key = self._key('gauge', name, labels)
+        with self.lock:
+            self.values[key] = value
+    def observe(self, name, value, **labels):
+        key = self._key('histogram', name, labels)
+        with self.lock:
+            h = self.values.get(key)
+            if h is None:
+                h = self.values[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            h[bisect.bisect_left(self.BUCKETS, value)] += 1
+            h[-1] += value
+    @classmethod
+    def labels(cls, labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ''
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{%s}' % (','.join('%s="%s"' % (k, escape(v)) for k, v in labels),)
+    def render(self):
+        with self.lock:
+            values = sorted((k, list(v) if isinstance(v, list) else v) for k, v in self.values.items())
+        lines = []
+        last = None
+        for (name, labels), value in values:
+            if name != last:
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s %s' % (name, self.kinds[name]))
+                last = name
+            if self.kinds[name] != 'histogram':
+                lines.append('%s%s %s' % (name, self.labels(labels), value))
+                continue
+            total = 0
+            for le, n in zip(self.BUCKETS + ('+Inf',), value):
+                total += n
+                lines.append('%s_bucket%s %d' % (name, self.labels(labels, le=le), total))
+            lines.append('%s_sum%s %r' % (name, self.labels(labels), value[-1]))
+            lines.append('%s_count%s %d' % (name, self.labels(labels), total))
+        return '\n'.join(lines) + '\n'
+
+class ThumbnailCache(object):
+    """PNG thumbnails of pictures, cached in memory and on disk.
 
-def serve_web(db, port):
-    from twisted.web import server, resource, static
-    from twisted.internet import reactor, endpoints
-    from PIL import Image
-    from cStringIO import StringIO
+    Thumbnails are keyed on the picture's path, the requested size and the
+    picture's mtime, so editing a picture makes its old thumbnails stale.
+    Both caches are size-capped; on disk the least recently used files are
+    pruned.  Hits, misses and render times are recorded in metrics, if
+    given."""
+    def __init__(self, directory='thumbs', max_memory=16<<20, max_disk=256<<20, metrics=None):
+        self.directory = directory
+        self.memory = LRUCache(max_memory)
+        self.max_disk = max_disk
+        self.disk_size = None
+        self.metrics = metrics
+        import threading
+        self.lock = threading.Lock()
+    def key(self, path, size):
+        mtime = os.path.getmtime(path)
+        return hashlib.sha1('%s\0%d\0%r' % (path, size, mtime)).hexdigest()
+    @classmethod
+    def render(cls, path, size):
+        from PIL import Image
+        from cStringIO import StringIO
+        im = Image.open(path)
+        im.thumbnail((size, size))
+        of = StringIO()
+        im.save(of, format='PNG')
+        v = of.getvalue()
+        of.close()
+        return v
+    def get(self, path, size):
+        """Thumbnail of path as PNG data.  Safe to call from worker threads."""
+        key = self.key(path, size)
+        with self.lock:
+            data = self.memory.get(key)
+        if data is not None:
+            if self.metrics:
+                self.metrics.count('ek_thumbnail_cache_total', result='memory')
+            return data
+        fn = os.path.join(self.directory, key + '.png')
+        if os.path.exists(fn):
+            with open(fn, 'rb') as f:
+                data = f.read()
+            os.utime(fn, None) # mark as recently used
+            if self.metrics:
+                self.metrics.count('ek_thumbnail_cache_total', result='disk')
+        else:
+            start = time.time()
+            data = self.render(path, size)
+            if self.metrics:
+                self.metrics.count('ek_thumbnail_cache_total', result='miss')
+                self.metrics.observe('ek_thumbnail_render_seconds', time.time() - start)
+            self.store(fn, data)
+        with self.lock:
+            self.memory.put(key, data)
+        return data
+    def store(self, fn, data):
+        import tempfile
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError: # lost a race with another thread
+                pass
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, fn)
+        with self.lock:
+            if self.disk_size is None:
+                self.prune()
+            else:
+                self.disk_size += len(data)
+                if self.disk_size > self.max_disk:
+                    self.prune()
+    def prune(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.png'):
+                st = os.stat(os.path.join(self.directory, name))
+                files.append((st.st_mtime, st.st_size, name))
+        files.sort()
+        self.disk_size = sum(f[1] for f in files)
+        while files and self.disk_size > self.max_disk:
+            _, size, name = files.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError: # already pruned by someone else
+                pass
+            self.disk_size -= size
+
+def pregenerate_thumbnails(db, thumbnails, sizes=(200,)):
+    """Build thumbnails ahead of time for every picture in the database.
+
+    Returns the number of thumbnails generated or checked."""
+    pics = []
+    for launch in db.launches:
+        pics.extend(launch.pics)
+    for payload in db.payloads.values():
+        pics.extend(payload.pics)
+    for flight in db.flights:
+        pics.extend(flight.pics or [])
+    count = 0
+    for path in sorted(set(pic.path for pic in pics)):
+        if not os.path.exists(path):
+            continue
+        for size in sizes:
+            thumbnails.get(path, size)
+            count += 1
+    return count
+
+def static_name(page, key=None, value=None):
+    """Filename under which export_site writes the page served at page?key=value."""
+    if key is None:
+        return page + '.html'
+    slug = urllib.quote(str(value), safe='').replace('_', '_5F').replace('%', '_')
+    if key in ('name', 'year'):
+        return '%s-%s.html' % (page, slug)
+    return '%s-%s-%s.html' % (page, key, slug)
+
+_pic_link = r'(href|src)="pic/([^"?]*)(?:\?size=(\d+))?"'
+_page_link = r'(href|src)="([a-z]+)(?:\?([a-z]+)=([^"]*))?"'
+def static_links(html):
+    """Rewrite the links in a page rendered for serve_web to point at the
+    files written by export_site."""
+    def pic(m):
+        if m.group(3):
+            return '%s="pic/%s.%s.png"' % (m.group(1), m.group(2), m.group(3))
+        return m.group(0)
+    def page(m):
+        if m.group(3):
+            return '%s="%s"' % (m.group(1), static_name(m.group(2), m.group(3), urllib.unquote(m.group(4))))
+        return '%s="%s"' % (m.group(1), static_name(m.group(2)))
+    return re.sub(_page_link, page, re.sub(_pic_link, pic, html))
+
+def _fingerprint(item):
+    if item is None:
+        return None
+    pics = [p.path for p in item.pics or []]
+    if isinstance(item, Flight):
+        return (item.name, item.date.isoformat(), item.ac, item.crew, item.comments, pics)
+    payload = item.payload
+    if payload is not None:
+        payload = (payload.name, payload.description, payload.paren, [p.path for p in payload.pics])
+    return (item.name, item.date.isoformat(), item.lv.name, payload, item.dest.abbr, item.result, item.comments, pics)
+
+def _catalogue_fingerprint(entry):
+    # an LV, stage, engine (or family), payload or picture as shown: resolved
+    # values, with pictures in full and other entries (and launches) by name
+    def shown(v):
+        if isinstance(v, Picture):
+            return _catalogue_fingerprint(v)
+        if isinstance(v, (Catalogued, Launch, LaunchView)):
+            return v.name
+        if isinstance(v, (tuple, list)):
+            return tuple(map(shown, v))
+        return v
+    return tuple((slot, shown(getattr(entry, slot, None))) for cls in type(entry).__mro__ for slot in getattr(cls, '__slots__', ()) if not slot.startswith('_'))
+
+def _write_file(fn, data):
+    tmp = fn + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, fn)
+
+_exporter = None
+def _export_job(job):
+    # Runs in an export_site worker process; _exporter is inherited via fork
+    directory, renderer = _exporter
+    if job[0] == 'page':
+        _, fn, method, kwargs = job
+        _write_file(os.path.join(directory, fn), static_links(getattr(renderer, method)(**kwargs)))
+    else:
+        _, path, size = job
+        dest = os.path.join(directory, 'pic', path)
+        if not os.path.isdir(os.path.dirname(dest)):
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError: # lost a race with another worker
+                pass
+        if size is None:
+            import shutil
+            shutil.copyfile(path, dest)
+        else:
+            _write_file('%s.%d.png' % (dest, size), ThumbnailCache.render(path, size))
+    return job
+
+def export_site(db, directory='html', processes=None, force=False, thumbnail_sizes=(200,)):
+    """Write every page served by serve_web into directory as static files.
+
+    Pages are rendered by the same HtmlRenderer methods, with links rewritten
+    (see static_name), across a pool of worker processes.  A manifest
+    records what each page was built from; unless force is set, a page is
+    only re-rendered when its launches (or flights) or the catalogue entries
+    it shows have changed, or when this module has.  Returns the number of files written."""
+    import json
+    import multiprocessing
+    global _exporter
+    salt = source_checksum()
+    def catalogue(kind, names):
+        table = getattr(db, kind + 's')
+        return [_catalogue_fingerprint(table[name][kind]) for name in sorted(names)]
+    def entity(kind, name):
+        # the entry, its family table (rooted at it) and the pages it links to
+        tree = getattr(db, kind + '_tree')
+        deps = catalogue(kind, db.flatten_tree({name: tree[name]}))
+        if kind != 'lv':
+            deps.append(db.used_by(kind, name, 'lv'))
+        if kind == 'engine':
+            deps.append(db.used_by(kind, name, 'stage'))
+        return deps + db.filter_launches(**{kind: name})
+    everything = [None] # summary pages are regenerated whenever anything changes
+    everything.extend(db.launches)
+    everything.extend(db.flights)
+    for kind in ('lv', 'stage', 'engine'):
+        everything.extend(catalogue(kind, getattr(db, kind + 's')))
+    pages = [('index.html', 'render_index', {}, []),
+             ('lpy.html', 'render_launches_per_year', {'maxdest': 2}, everything),
+             ('lvf.html', 'render_lv_families', {'maxdepth': 2, 'maxdest': 1}, everything),
+             ('bsf.html', 'render_stage_families', {'maxdepth': 2, 'maxdest': 1, 'vac': False}, everything),
+             ('vsf.html', 'render_stage_families', {'maxdepth': 2, 'maxdest': 1, 'vac': True}, everything),
+             ('bef.html', 'render_engine_families', {'maxdepth': 2, 'maxdest': 1, 'vac': False}, everything),
+             ('vef.html', 'render_engine_families', {'maxdepth': 2, 'maxdest': 1, 'vac': True}, everything),
+             ('flights.html', 'render_flights', {}, db.flights)]
+    for kind, page in HtmlRenderer.reliability_pages.items():
+        pages.append((static_name(page), 'render_reliability', {'kind': kind}, everything))
+        for sort in HtmlRenderer.RANKINGS:
+            pages.append((static_name(page, 'sort', sort), 'render_reliability', {'kind': kind, 'sort': sort}, everything))
+    for name in db.lvs:
+        pages.append((static_name('lv', 'name', name), 'render_lv_info', {'name': name}, entity('lv', name)))
+    for name in db.stages:
+        pages.append((static_name('stage', 'name', name), 'render_stage_info', {'name': name}, entity('stage', name)))
+    for name in db.engines:
+        pages.append((static_name('engine', 'name', name), 'render_engine_info', {'name': name}, entity('engine', name)))
+    years = db.launches_by_year.keys()
+    for year in years:
+        # the prev/next links depend on the range of years too
+        pages.append((static_name('year', 'year', year), 'launches_for_year', {'year': year}, [None, (min(years), max(years))] + db.filter_launches(year=year)))
+    for name, payload in db.payloads.items():
+        pages.append((static_name('payload', 'name', name), 'render_payload_info', {'name': name}, [_catalogue_fingerprint(payload), payload.launch]))
+    for name, launch in db.launches_by_name.items():
+        pages.append((static_name('launch', 'name', name), 'render_launch_info', {'name': name}, [launch]))
+    for name, flight in db.flights_by_name.items():
+        pages.append((static_name('flight', 'name', name), 'render_flight_info', {'name': name}, [flight]))
+    for ac in set(f.ac for f in db.flights):
+        pages.append((static_name('flights', 'ac', ac), 'render_flights', {'ac': ac}, db.filter_flights(ac=ac)))
+    for crew in set(c for f in db.flights for c in f.crew):
+        pages.append((static_name('flights', 'crew', crew), 'render_flights', {'crew': crew}, db.filter_flights(crew=crew)))
+    for name in db.people():
+        person = db.person(name)
+        pages.append((static_name('person', 'name', name), 'render_person', {'name': name}, person['launches'] + person['flights']))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest_fn = os.path.join(directory, '.manifest')
+    old = {}
+    if os.path.exists(manifest_fn) and not force:
+        with open(manifest_fn) as f:
+            old = json.load(f)
+    manifest = {}
+    jobs = []
+    for fn, method, kwargs, deps in pages:
+        key = hashlib.sha1(repr((salt, method, sorted(kwargs.items()), [_fingerprint(d) if isinstance(d, (Launch, LaunchView, Flight)) else d for d in deps]))).hexdigest()
+        manifest[fn] = key
+        if old.get(fn) != key or not os.path.exists(os.path.join(directory, fn)):
+            jobs.append(('page', fn, method, kwargs))
+    pics = set()
+    for item in list(db.launches) + db.payloads.values() + db.flights:
+        pics.update(p.path for p in item.pics or [])
+    for path in sorted(pics):
+        if not os.path.exists(path):
+            continue
+        mtime = os.path.getmtime(path)
+        for size in (None,) + tuple(thumbnail_sizes):
+            fn = os.path.join('pic', path)
+            if size is not None:
+                fn = '%s.%d.png' % (fn, size)
+            manifest[fn] = repr(mtime)
+            if old.get(fn) != repr(mtime) or not os.path.exists(os.path.join(directory, fn)):
+                jobs.append(('pic', path, size))
+    renderer = HtmlRenderer(db)
+    renderer.searchable = False
+    _exporter = (directory, renderer)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for _ in pool.imap_unordered(_export_job, jobs):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+        _exporter = None
+    for fn in old:
+        if fn not in manifest and os.path.exists(os.path.join(directory, fn)):
+            os.remove(os.path.join(directory, fn))
+    _write_file(manifest_fn, json.dumps(manifest, indent=0, sort_keys=True))
+    return len(jobs)
+
+def serve_web(db, port, cache_size=32<<20, thumbnails=None, snapshot=None, listener=None, metrics=None, profiles=None):
+    """Serve the site over HTTP on port, or on the already-listening socket
+    whose file descriptor is listener.
+
+    If db was loaded from snapshot, the server switches to a newer one as
+    soon as it is written (Database.save() renames it into place).  Request,
+    render and cache statistics are kept in metrics, and served (for
+    Prometheus) on /metrics.  Pages with launch or flight histories are sent
+    as they are rendered, rather than after, unless they are in the cache.
+
+    If a profiles directory is given, adding profile=1 to a page's query
+    renders it afresh under cProfile; the profile is saved in profiles, and
+    a summary of it is served instead of the page.  Saved profiles are
+    listed on /profile."""
+    from twisted.web import server, resource, static, http
+    from twisted.internet import reactor, endpoints, threads
     import os.path
+    import socket
+    cache = LRUCache(cache_size, sizeof=lambda entry: len(entry[2]))
+    if metrics is None:
+        metrics = Metrics()
+    if thumbnails is None:
+        thumbnails = ThumbnailCache(metrics=metrics)
+    elif thumbnails.metrics is None:
+        thumbnails.metrics = metrics
+    for name, text in (('ek_requests_total', "Requests served, by page and HTTP status."),
+                       ('ek_request_seconds', "Time taken to answer requests, by page."),
+                       ('ek_errors_total', "Requests answered with an error page, by page."),
+                       ('ek_render_seconds', "Time spent rendering pages not in the page cache, by page and phase (database, tree, flatten)."),
+                       ('ek_page_cache_total', "Page cache lookups, by result (hit, miss)."),
+                       ('ek_page_cache_bytes', "Size of the pages in the page cache."),
+                       ('ek_page_cache_entries', "Number of pages in the page cache."),
+                       ('ek_thumbnail_cache_total', "Thumbnail lookups, by result (memory, disk, miss)."),
+                       ('ek_thumbnail_render_seconds', "Time spent generating thumbnails."),
+                       ('ek_database_version', "Version of the database being served.")):
+        metrics.describe(name, text)
+    def stamp():
+        try:
+            st = os.stat(snapshot)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+    loaded = [stamp() if snapshot else None]
+    def refresh():
+        now = stamp() if snapshot else None
+        if now is None or now == loaded[0]:
+            return
+        new = Database.load(snapshot)
+        if new is not None:
+            # a snapshot that would not load is tried again next time
+            loaded[0] = now
+            rend.db = new
+            cache.clear()
+    def page_name(request):
+        return '/' + (request.prepath[0] if request.prepath else '')
+
+    class TimedDatabase(object):
+        """Proxy for the Database which adds up the time spent in it."""
+        def __init__(self, db):
+            self._db = db
+            self._elapsed = 0.0
+        def __getattr__(self, name):
+            start = time.time()
+            value = getattr(self._db, name)
+            if callable(value):
+                def timed(*args, **kwargs):
+                    start = time.time()
+                    try:
+                        return value(*args, **kwargs)
+                    finally:
+                        self._elapsed += time.time() - start
+                return timed
+            self._elapsed += time.time() - start
+            return value
+
+    class TimedRenderer(HtmlRenderer):
+        """HtmlRenderer which splits the time taken by each render into
+        Database work, flatten() and (the rest) building the nevow tree."""
+        flattening = 0.0
+        def flatten(self, page):
+            start = time.time()
+            try:
+                return HtmlRenderer.flatten(self, page)
+            finally:
+                self.flattening += time.time() - start
+        def timed(self, page, render):
+            db = self.db
+            self.db = TimedDatabase(db)
+            self.flattening = 0.0
+            start = time.time()
+            try:
+                return render()
+            finally:
+                total = time.time() - start
+                database = self.db._elapsed
+                self.db = db
+                metrics.observe('ek_render_seconds', database, page=page, phase='database')
+                metrics.observe('ek_render_seconds', self.flattening, page=page, phase='flatten')
+                metrics.observe('ek_render_seconds', total - database - self.flattening, page=page, phase='tree')
+
     class Page(resource.Resource):
         """Abstract base class for HTML pages."""
         isLeaf = True
 
+        def render(self, request):
+            page = page_name(request)
+            start = time.time()
+            def finished(result):
+                metrics.count('ek_requests_total', page=page, code=request.code)
+                metrics.observe('ek_request_seconds', time.time() - start, page=page)
+            request.notifyFinish().addBoth(finished)
+            return resource.Resource.render(self, request)
+
         def flatten_args(self, request):
             for k in request.args.keys():
                 v = request.args[k]
@@ -1058,7 +3178,62 @@ def serve_web(db, port):
                     elif not l:
                         del request.args[k]
 
-        def error(self, msg):
+        def cached(self, request, render):
+            """Serve the output of render() through the page cache.
+
+            Entries are keyed on path and query args, and are only valid for
+            the database version they were rendered from.  Conditional GETs
+            are answered with 304 Not Modified."""
+            refresh()
+            db = rend.db
+            if self.flag(request.args.pop('profile', None)):
+                if profiles is None:
+                    raise Exception("Profiling is not enabled")
+                page = page_name(request)
+                body, fn = profile_call(render, profiles, page.strip('/') or 'index')
+                return rend.render_profile(os.path.basename(fn))
+            key = self.cache_key(request)
+            entry = self.lookup(key, db)
+            if entry is None:
+                body = rend.timed(page_name(request), render)
+                entry = (db.version, '"%s"' % (hashlib.sha1(body).hexdigest(),), body)
+                cache.put(key, entry)
+            return self.respond(request, entry, db)
+
+        @classmethod
+        def flag(cls, value):
+            # as for render_crosstab's flags, profile=0 means no
+            return value not in (None, False, '', '0')
+
+        def cache_key(self, request):
+            args = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in request.args.items()))
+            return (request.path, args)
+
+        def lookup(self, key, db):
+            entry = cache.get(key)
+            if entry is not None and entry[0] == db.version:
+                metrics.count('ek_page_cache_total', result='hit')
+                return entry
+            metrics.count('ek_page_cache_total', result='miss')
+            return None
+
+        def respond(self, request, entry, db):
+            version, etag, body = entry
+            if self.not_modified(request, db, etag):
+                return ''
+            return body
+
+        def not_modified(self, request, db, etag=None):
+            # If-None-Match, when sent, overrides If-Modified-Since (RFC 7232)
+            if request.getHeader('if-none-match') is None:
+                if etag is not None:
+                    request.setETag(etag)
+                return request.setLastModified(db.modified) == http.CACHED
+            request.setHeader('last-modified', http.datetimeToString(int(math.ceil(db.modified))))
+            return etag is not None and request.setETag(etag) == http.CACHED
+
+        def error(self, request, msg):
+            metrics.count('ek_errors_total', page=page_name(request))
             return t.html[t.head[t.title['Encyclopædia Kerbonautica']],
                           t.body[t.h1["Error"],
                                  t.h2[msg]]]
@@ -1071,6 +3246,23 @@ def serve_web(db, port):
 
     class PictureResource(Page):
         isLeaf = True
+        def render_thumbnail(self, request, path, size):
+            # PIL is slow; keep it off the reactor thread
+            d = threads.deferToThread(thumbnails.get, path, size)
+            gone = []
+            request.notifyFinish().addBoth(gone.append)
+            def done(data):
+                if not gone:
+                    request.setHeader("content-type", "image/png")
+                    request.write(data)
+                    request.finish()
+            def failed(f):
+                if not gone:
+                    request.setHeader("content-type", "text/html; charset=utf-8")
+                    request.write(flatten(self.error(request, f.getErrorMessage())))
+                    request.finish()
+            d.addCallbacks(done, failed)
+            return server.NOT_DONE_YET
         def render_GET(self, request):
             debug = request.args.pop('debug', 0)
             try:
@@ -1082,42 +3274,18 @@ def serve_web(db, port):
                 size = request.args.get('size', None)
                 if not path_in(path, '.'):
                     raise Exception("Bad path, reaches outside root")
+                if not os.path.isfile(path):
+                    raise Exception("No such picture '%s'"%(path,))
                 # XXX We should probably do a mime-type check on the file, but KSP screenshots are always PNGs so this should work
-                request.setHeader("content-type", "image/png")
-                f = open(path, "rb")
                 if size is not None:
-                    size = int(size)
-                    im = Image.open(f)
-                    im.thumbnail((size, size))
-                    of = StringIO()
-                    im.save(of, format='PNG')
-                    v = of.getvalue()
-                    of.close()
-                    return v
-                # XXX Strictly speaking we should probably mess around with a twisted.internet.interfaces.IPullProducer, but this will do for now
-                return f.read()
+                    return self.render_thumbnail(request, path, int(size))
+                # static.File streams the file with a producer, and handles Range requests
+                return static.File(os.path.abspath(path), defaultType='image/png').render_GET(request)
             except Exception as e:
                 if debug:
                     raise
                 request.setHeader("content-type", "text/html; charset=utf-8")
-                return flatten(self.error(e.message))
-
-    class Index(Page):
-        def render_GET(self, request):
-            self.flatten_args(request)
-            page = t.html[t.head[t.title['Encyclopædia Kerbonautica']],
-                          t.body[t.h1['Encyclopædia Kerbonautica'],
-                                 t.ul[t.li[t.a(href='lpy')['Launches per year']],
-                                      t.li[t.a(href='lvf')['Launch-vehicle families']],
-                                      t.li[t.a(href='bsf')['Booster stages']],
-                                      t.li[t.a(href='vsf')['Upper stages']],
-                                      t.li[t.a(href='bef')['Atmospheric engines']],
-                                      t.li[t.a(href='vef')['Vacuum engines']],
-                                      t.li[t.a(href='flights')['Aircraft flights']],
-                                      ]
-                                 ]]
-            request.setHeader("content-type", "text/html; charset=utf-8")
-            return flatten(page)
+                return flatten(self.error(request, e.message))
 
     class Renderer(Page):
         def __init__(self, func, *args, **kwargs):
@@ -1126,10 +3294,11 @@ def serve_web(db, port):
             self.kwargs = kwargs
         def render_GET(self, request):
             request.setHeader("content-type", "text/html; charset=utf-8")
+            self.flatten_args(request)
             try:
-                return flatten(self.func(*self.args, **self.kwargs))
+                return self.cached(request, lambda: flatten(self.func(*self.args, **self.kwargs)))
             except Exception as e:
-                return flatten(self.error(e.message))
+                return flatten(self.error(request, e.message))
 
     class PageWithArgs(Page):
         def content(self, **kwargs):
@@ -1139,12 +3308,11 @@ def serve_web(db, port):
             self.flatten_args(request)
             debug = request.args.pop('debug', 0)
             try:
-                page = self.content(**request.args)
+                return self.cached(request, lambda: flatten(self.content(**request.args)))
             except Exception as e:
                 if debug:
                     raise
-                return flatten(self.error(e.message))
-            return flatten(page)
+                return flatten(self.error(request, e.message))
 
     class RendererWithArgs(PageWithArgs):
         def __init__(self, func, *args, **kwargs):
@@ -1156,43 +3324,230 @@ def serve_web(db, port):
             k.update(self.kwargs)
             return self.func(*self.args, **k)
 
-    rend = HtmlRenderer(db)
+    class ChunkProducer(object):
+        """Pull producer which writes a page to the client a chunk at a
+        time, as the connection is ready for more, then puts the page in
+        the cache (if it fits)."""
+        def __init__(self, request, chunks, key, version):
+            self.request = request
+            self.chunks = chunks
+            self.key = key
+            self.version = version
+            self.body = []
+            self.size = 0
+            request.registerProducer(self, False)
+        def resumeProducing(self):
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.request.unregisterProducer()
+                self.request.finish()
+                if self.body is not None:
+                    body = ''.join(self.body)
+                    cache.put(self.key, (self.version, '"%s"' % (hashlib.sha1(body).hexdigest(),), body))
+                return
+            except Exception:
+                # too late for an error page; cut the response short instead
+                from twisted.python import log
+                log.err(None, "Error streaming %s" % (self.request.path,))
+                metrics.count('ek_errors_total', page=page_name(self.request))
+                self.request.unregisterProducer()
+                self.request.loseConnection()
+                return
+            if self.body is not None:
+                self.body.append(chunk)
+                self.size += len(chunk)
+                if self.size > cache.max_size:
+                    self.body = None
+            self.request.write(chunk)
+        def pauseProducing(self):
+            pass
+        def stopProducing(self):
+            # the client went away
+            self.chunks.close()
+            self.body = None
+
+    class StreamedRenderer(RendererWithArgs):
+        """RendererWithArgs for long pages, which (unless they are in the
+        cache) are sent as they are flattened, with chunked transfer-encoding,
+        rather than all at once."""
+        def render_GET(self, request):
+            self.flatten_args(request)
+            if self.flag(request.args.get('profile')) or 'debug' in request.args:
+                return RendererWithArgs.render_GET(self, request)
+            request.args.pop('profile', None)
+            request.setHeader("content-type", "text/html; charset=utf-8")
+            try:
+                refresh()
+                db = rend.db
+                key = self.cache_key(request)
+                entry = self.lookup(key, db)
+                if entry is not None:
+                    return self.respond(request, entry, db)
+                k = dict(request.args)
+                k.update(self.kwargs)
+                streamer = StreamingRenderer(db)
+                render = getattr(streamer, self.func.__name__)
+                chunks = streamer.stream(page_name(request), lambda: render(*self.args, **k))
+            except Exception as e:
+                return flatten(self.error(request, e.message))
+            if self.not_modified(request, db):
+                return ''
+            ChunkProducer(request, chunks, key, db.version)
+            return server.NOT_DONE_YET
+
+    class StreamingRenderer(TimedRenderer):
+        """TimedRenderer whose pages come out as a generator of chunks (see
+        HtmlRenderer.chunks) rather than as a string.  One is made for each
+        page streamed, as several may be part-sent at once."""
+        def flatten(self, page):
+            return self.chunks(page)
+        def stream(self, page, render):
+            """As timed(), but render() returns a generator of chunks, which
+            is returned wrapped so that the time taken to produce them counts
+            too; it is recorded once the page is finished (or abandoned)."""
+            self.db = TimedDatabase(self.db)
+            start = time.time()
+            chunks = render()
+            return self.timed_chunks(page, chunks, time.time() - start, self.db._elapsed)
+        def timed_chunks(self, page, chunks, building, database):
+            # rows are built as they are flattened, so count as flatten time
+            flattening = 0.0
+            try:
+                while True:
+                    start = time.time()
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        break
+                    finally:
+                        flattening += time.time() - start
+                    yield chunk
+            finally:
+                chunks.close()
+                total = self.db._elapsed
+                metrics.observe('ek_render_seconds', total, page=page, phase='database')
+                metrics.observe('ek_render_seconds', flattening - (total - database), page=page, phase='flatten')
+                metrics.observe('ek_render_seconds', building - database, page=page, phase='tree')
+
+    class ProfileResource(Page):
+        # not cached, as new profiles can appear at any time
+        def render_GET(self, request):
+            request.setHeader("content-type", "text/html; charset=utf-8")
+            self.flatten_args(request)
+            try:
+                if profiles is None:
+                    raise Exception("Profiling is not enabled")
+                return rend.render_profile(**request.args)
+            except Exception as e:
+                return flatten(self.error(request, e.message))
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+        def render_GET(self, request):
+            metrics.gauge('ek_page_cache_bytes', cache.size)
+            metrics.gauge('ek_page_cache_entries', len(cache))
+            metrics.gauge('ek_database_version', rend.db.version)
+            request.setHeader("content-type", "text/plain; version=0.0.4")
+            return metrics.render()
+
+    rend = TimedRenderer(db)
+    rend.profiles = profiles
     root = resource.Resource()
-    root.putChild('', Index())
+    root.putChild('', Renderer(rend.render_index))
     root.putChild('lpy', Renderer(rend.render_launches_per_year, 2))
-    root.putChild('lvf', Renderer(rend.render_lv_families, 2, 1))
-    root.putChild('bsf', Renderer(rend.render_stage_families, 2, 1, vac=False))
-    root.putChild('vsf', Renderer(rend.render_stage_families, 2, 1, vac=True))
-    root.putChild('bef', Renderer(rend.render_engine_families, 2, 1, vac=False))
-    root.putChild('vef', Renderer(rend.render_engine_families, 2, 1, vac=True))
-    root.putChild('flights', RendererWithArgs(rend.render_flights))
-    root.putChild('lv', RendererWithArgs(rend.render_lv_info))
-    root.putChild('stage', RendererWithArgs(rend.render_stage_info))
-    root.putChild('engine', RendererWithArgs(rend.render_engine_info))
-    root.putChild('year', RendererWithArgs(rend.launches_for_year))
+    root.putChild('lvf', RendererWithArgs(rend.render_lv_families, 2, 1))
+    root.putChild('bsf', RendererWithArgs(rend.render_stage_families, 2, 1, vac=False))
+    root.putChild('vsf', RendererWithArgs(rend.render_stage_families, 2, 1, vac=True))
+    root.putChild('bef', RendererWithArgs(rend.render_engine_families, 2, 1, vac=False))
+    root.putChild('vef', RendererWithArgs(rend.render_engine_families, 2, 1, vac=True))
+    for kind, page in rend.reliability_pages.items():
+        root.putChild(page, RendererWithArgs(rend.render_reliability, kind))
+    root.putChild('cube', RendererWithArgs(rend.render_crosstab))
+    root.putChild('flights', StreamedRenderer(rend.render_flights))
+    root.putChild('lv', StreamedRenderer(rend.render_lv_info))
+    root.putChild('stage', StreamedRenderer(rend.render_stage_info))
+    root.putChild('engine', StreamedRenderer(rend.render_engine_info))
+    root.putChild('year', StreamedRenderer(rend.launches_for_year))
     root.putChild('payload', RendererWithArgs(rend.render_payload_info))
     root.putChild('launch', RendererWithArgs(rend.render_launch_info))
     root.putChild('flight', RendererWithArgs(rend.render_flight_info))
+    root.putChild('person', StreamedRenderer(rend.render_person))
+    root.putChild('search', RendererWithArgs(rend.render_search))
     root.putChild('pic', PictureResource())
-    ep = "tcp:%d"%(port,)
-    endpoints.serverFromString(reactor, ep).listen(server.Site(root))
+    root.putChild('profile', ProfileResource())
+    root.putChild('metrics', MetricsResource())
+    if listener is None:
+        ep = "tcp:%d"%(port,)
+        endpoints.serverFromString(reactor, ep).listen(server.Site(root))
+    else:
+        reactor.adoptStreamPort(listener, socket.AF_INET, server.Site(root))
+        os.close(listener)
     reactor.run()
 
+def serve_workers(snapshot, port, workers, cache_size=32<<20):
+    """Serve a snapshot written by Database.save() from several processes,
+    all accepting connections from one listening socket.
+
+    Workers are fresh interpreters (the reactor cannot be shared across a
+    fork) which each load the snapshot rather than rebuilding the database,
+    and pick up a new snapshot when one is written over it.
+
+    Nothing but the socket is shared: each worker unpickles a private copy
+    of the database, and builds its own indexes when a page first needs
+    them.  At 20,000 launches that is about half a second and 50MB per
+    worker to load, and another 3s and 50MB or so for the indexes, on top
+    of the web stack's own start-up and memory."""
+    import signal
+    import socket
+    import subprocess
+    import sys
+    if Database.load(snapshot) is None:
+        raise Exception("No usable snapshot '%s'" % (snapshot,))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', port))
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    code = "import sys; sys.path.insert(0, %r); import ek; ek._serve_worker(%d, %r, %d)" % (os.path.dirname(os.path.abspath(__file__)), sock.fileno(), snapshot, cache_size)
+    children = [subprocess.Popen([sys.executable, '-c', code]) for i in xrange(workers)]
+    sock.close()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
+
+def _serve_worker(listener, snapshot, cache_size):
+    # Runs in a serve_workers process; listener is the inherited socket
+    db = Database.load(snapshot)
+    if db is None:
+        raise Exception("No usable snapshot '%s'" % (snapshot,))
+    serve_web(db, None, cache_size, snapshot=snapshot, listener=listener)
+
 def test_text(db):
     # Render text tables
-    rend = TextRenderer(db)
-    print rend.render_launches_per_year(2)
+    import sys
+    rend = TextRenderer(db, sys.stdout)
+    rend.render_launches_per_year(2)
     print
-    print rend.render_lv_families(2, 1)
+    rend.render_lv_families(2, 1)
     print
     print "Booster stages:"
-    print rend.render_stage_families(2, 1, False)
+    rend.render_stage_families(2, 1, False)
     print
     print "Upper stages:"
-    print rend.render_stage_families(2, 1, True)
+    rend.render_stage_families(2, 1, True)
     print
     print "Atmospheric engines:"
-    print rend.render_engine_families(2, 1, False)
+    rend.render_engine_families(2, 1, False)
     print
     print "Vacuum engines:"
-    print rend.render_engine_families(2, 1, True)
+    rend.render_engine_families(2, 1, True)
@@ -1,6 +1,7 @@
 #!/usr/bin/python2
 # encoding: utf-8
 from ek import *
+import sys
 
 def testdb():
     # Some test data from my own RP-1 game
@@ -334,12 +335,39 @@ if __name__ == '__main__':
     x = optparse.OptionParser()
     x.add_option('-w', '--web', action='store_true')
     x.add_option('-p', '--port', type='int', help='TCP port number to serve', default=8080)
+    x.add_option('-t', '--thumbnails', action='store_true', help='Pre-generate thumbnails for all pictures')
+    x.add_option('-e', '--export', metavar='DIR', help='Export the whole site as static files into DIR')
+    x.add_option('-s', '--snapshot', metavar='FILE', help='Load the database from snapshot FILE, rebuilding it if stale')
+    x.add_option('-P', '--profile', metavar='DIR', help='Profile the renders, saving the profile in DIR; with --web, allow profile=1 requests, which save theirs there')
+    x.add_option('-j', '--workers', type='int', help='Number of web server processes (needs --snapshot)', default=1)
     opts, args = x.parse_args()
     if args:
         x.error("Unexpected positional arguments")
-    db = testdb()
-    if opts.web:
-        serve_web(db, opts.port)
+    if opts.workers > 1 and not opts.snapshot:
+        x.error("--workers needs --snapshot")
+    db = None
+    if opts.snapshot:
+        db = Database.load(opts.snapshot, source_checksum(__file__))
+    if db is None:
+        db = testdb()
+        if opts.snapshot:
+            db.save(opts.snapshot, source_checksum(__file__))
+    if opts.thumbnails:
+        print "%d thumbnails ready" % (pregenerate_thumbnails(db, ThumbnailCache()),)
+    def run():
+        if opts.export:
+            print "%d files written" % (export_site(db, opts.export),)
+        elif opts.web and opts.workers > 1:
+            serve_workers(opts.snapshot, opts.port, opts.workers)
+        elif opts.web:
+            serve_web(db, opts.port, snapshot=opts.snapshot, profiles=opts.profile)
+        else:
+            test_html(db)
+            test_text(db)
+    if opts.profile and not opts.web:
+        _, fn = profile_call(run, opts.profile, 'export' if opts.export else 'test')
+        print
+        print "Profile saved to %s" % (fn,)
+        TextRenderer(db, sys.stdout).render_profile(fn)
     else:
-        test_html(db)
-        test_text(db)
+        run()
@@ -0,0 +1,227 @@
+#!/usr/bin/python2
+# encoding: utf-8
+"""Tests for ek.  Run with: python -m unittest test_ek"""
+from ek import *
+import ek
+from cStringIO import StringIO
+import pprint
+import unittest
+import sample
+
+_launches = None
+def sample_launches():
+    # testdb() is slowish, and noisy; build it once
+    global _launches
+    if _launches is None:
+        import sys
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            _launches = list(sample.testdb().launches)
+        finally:
+            sys.stdout = stdout
+    return _launches
+
+def text_tables(db):
+    out = StringIO()
+    rend = TextRenderer(db, out)
+    rend.render_launches_per_year(2)
+    rend.render_lv_families(2, 1)
+    rend.render_stage_families(2, 1, False)
+    rend.render_stage_families(2, 1, True)
+    rend.render_engine_families(2, 1, False)
+    rend.render_engine_families(2, 1, True)
+    return out.getvalue()
+
+class IncrementalTest(unittest.TestCase):
+    """add_launch, remove_launch and amend_launch must leave the Database
+    just as a full update() from the same launches would."""
+    def assertSameDatabase(self, db, launches):
+        ref = Database(list(launches))
+        for attr in ('lvs', 'stages', 'engines', 'lv_tree', 'stage_tree', 'engine_tree', 'dest_tree', '_cells'):
+            self.assertEqual(pprint.pformat(getattr(db, attr)), pprint.pformat(getattr(ref, attr)), attr)
+        # launches may be LaunchViews in one and Launches in the other
+        def ident(launch):
+            return (launch.name, launch.date)
+        self.assertEqual(sorted((y, map(ident, v)) for y, v in db.launches_by_year.items()),
+                         sorted((y, map(ident, v)) for y, v in ref.launches_by_year.items()))
+        # ids and sequence numbers of re-added launches differ; the order must not
+        def postings(d):
+            return dict((k, [ident(d._launch(i)) for when, seq, i in v]) for k, v in d._postings.items())
+        self.assertEqual(postings(db), postings(ref))
+        self.assertEqual(text_tables(db), text_tables(ref))
+    def test_add(self):
+        launches = sample_launches()
+        db = Database(launches[:40])
+        for launch in launches[40:]:
+            db.add_launch(launch)
+        self.assertSameDatabase(db, launches)
+    def test_remove_and_readd(self):
+        launches = sample_launches()
+        db = Database(list(launches))
+        removed = [db.remove_launch(launch.name) for launch in launches[10::7]]
+        self.assertSameDatabase(db, db.launches)
+        for launch in removed:
+            db.add_launch(launch)
+        self.assertSameDatabase(db, db.launches)
+    def test_amend(self):
+        launches = sample_launches()
+        db = Database(list(launches))
+        for old, new in zip(launches[5::9], launches[50::9]):
+            db.amend_launch(old.name, Launch(old.name, new.date, new.lv, new.payload, new.dest, new.result, new.comments))
+        self.assertSameDatabase(db, db.launches)
+    def test_table(self):
+        # a LaunchTable's stats are tallied a group of alike launches at a time
+        launches = sample_launches()
+        db = Database(LaunchTable(launches))
+        self.assertSameDatabase(db, launches)
+        db.remove_launch(launches[3].name)
+        db.add_launch(launches[3])
+        self.assertSameDatabase(db, launches[:3] + launches[4:] + launches[3:4])
+    def test_indexes(self):
+        # the indexes are only built when first used, and hold ids, not views
+        db = Database(LaunchTable(sample_launches()))
+        self.assertNotIn('_postings', vars(db))
+        launch = db.filter_launches()[-1]
+        self.assertEqual(set(type(i) for when, seq, i in db._postings[None]), set([int]))
+        self.assertEqual(db.find_launch(launch.name), launch)
+    def test_iter_while_changing(self):
+        # a page being streamed lists the launches as they were when it began
+        launches = sample_launches()
+        lv = launches[0].lv.name
+        for kwargs in ({}, {'lv': lv}, {'lv': lv, 'year': launches[0].date.year}):
+            db = Database(list(launches))
+            expected = db.filter_launches(**kwargs)
+            it = db.iter_launches(**kwargs)
+            got = [next(it)]
+            db.remove_launch(expected[0].name)
+            got.extend(it)
+            self.assertEqual(got, expected, kwargs)
+    def test_usage_after_catalogue_change(self):
+        # an LV's stages changing while it is flown must not leave it (or
+        # take off a stage it never had) once it stops being flown
+        launches = sample_launches()
+        db = Database(list(launches))
+        lv = launches[0].lv
+        flown = [l for l in db.launches if l.lv is lv]
+        stages = lv.stages
+        try:
+            lv.stages = [l.lv.stages for l in launches if set(l.lv.stages) - set(stages)][0]
+            for launch in flown:
+                db._count_use(launch, -1)
+        finally:
+            lv.stages = stages
+        self.assertEqual([k for k, users in db._users.items() if ('lv', lv.name) in users], [])
+        self.assertEqual(db._users, Database([l for l in launches if l.lv is not lv])._users)
+
+class ResultTest(unittest.TestCase):
+    """How results are counted, tuple results especially."""
+    def test_tuple(self):
+        # a tuple result is a flight, and a failure of its LV, whatever its
+        # primary code
+        for code in ((0, 1), (-2, 1), (1, 2)):
+            status = Result.of(code)
+            self.assertTrue(status.flew, code)
+            self.assertEqual(status.lv_field, 'failure', code)
+        self.assertFalse(Result.of(-2).flew)
+        self.assertEqual(Result.of(0).lv_field, 'success')
+    def test_stages(self):
+        # (stage stat, failures, stat of its working engines, how many)
+        self.assertEqual(Result.of(2).stages((1, 3, 1)),
+                         (('mission_failure', 0, 'mission_failure', 1), ('failure', 1, 'mission_failure', 2), ('lower_failure', 0, 'lower_failure', 1)))
+        self.assertEqual(Result.of((2, 3)).stages((1, 3, 1)),
+                         (('mission_failure', 0, 'mission_failure', 1), ('failure', 1, None, 2), (None, 1, None, 0)))
+        # no fewer than no working engines
+        self.assertEqual(Result.of((1, 1, 1)).stages((2,)), (('failure', 3, None, 0),))
+    def test_sample(self):
+        db = Database(list(sample_launches()))
+        lv = db.lv_family('Leibnitz C')
+        self.assertEqual((lv['success'], lv['failure'], lv['mission_failure']), (19, 2, 1))
+        en = db.engine_family('H-1')
+        self.assertEqual((en['success'], en['failure'], en['mission_failure']), (100, 4, 7))
+
+class SnapshotTest(unittest.TestCase):
+    """A loaded snapshot is the Database it was saved from."""
+    def test_round_trip(self):
+        import os, tempfile
+        launches = sample_launches()
+        db = Database(LaunchTable(launches))
+        found = [(kind, item.name) for kind, item in db.search('saturn')]
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            db.save(fn, 'data')
+            self.assertEqual(Database.load(fn, 'other data'), None)
+            loaded = Database.load(fn, 'data')
+        finally:
+            os.remove(fn)
+        # just the stats are saved; the indexes are built again when used
+        self.assertNotIn('_postings', vars(loaded))
+        self.assertEqual(text_tables(loaded), text_tables(db))
+        self.assertEqual([(kind, item.name) for kind, item in loaded.search('saturn')], found)
+        loaded.remove_launch(launches[3].name)
+        self.assertEqual(text_tables(loaded), text_tables(Database(launches[:3] + launches[4:])))
+
+class TableTest(unittest.TestCase):
+    cols = [{'head': 'A', 'key': 'a'}, {'head': 'Bee', 'key': 'b'}]
+    rows = [{'a': i, 'b': 'x' * (i % 7)} for i in xrange(20)] + ['-', {'a': 99, 'b': 'yy'}]
+    def test_declared_widths(self):
+        # with the widest cells' widths declared, the table comes out the same
+        rend = TextRenderer(None)
+        declared = [dict(c, width=w) for c, w in zip(self.cols, (2, 6))]
+        self.assertEqual(list(rend.table_lines(declared, self.rows)), list(rend.table_lines(self.cols, self.rows)))
+    def test_streamed(self):
+        # ... and lines come out before the rows run out
+        def rows():
+            for row in self.rows:
+                yield row
+            raise AssertionError("read past the first rows")
+        declared = [dict(c, width=6) for c in self.cols]
+        lines = TextRenderer(None).table_lines(declared, rows())
+        self.assertEqual([next(lines) for i in xrange(3)], [' A      | Bee    |', ' 0      |        |', ' 1      | x      |'])
+
+class ChunksTest(unittest.TestCase):
+    def renderer(self):
+        rend = HtmlRenderer(Database(list(sample_launches())))
+        rend.flatten = rend.chunks
+        rend.chunk_size = 1000
+        return rend
+    def test_streamed(self):
+        # a long launch history comes out in several chunks, which make up
+        # the same page as flattening it all at once
+        chunks = list(self.renderer().render_engine_info(name='H-1'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), HtmlRenderer(Database(list(sample_launches()))).render_engine_info(name='H-1'))
+    def test_lazy(self):
+        # rows are only built as they are reached
+        rend = self.renderer()
+        built = []
+        row = rend.launch_row
+        rend.launch_row = lambda launch: built.append(launch) or row(launch)
+        chunks = rend.render_engine_info(name='H-1')
+        next(chunks)
+        self.assertLess(len(built), 10)
+        list(chunks)
+        self.assertGreater(len(built), 10)
+
+class ImportTimeTest(unittest.TestCase):
+    """Importing ek must be quick, and leave the HTML/web stack unloaded."""
+    budget = 0.05
+    def setUp(self):
+        # compiled up front, so that only the import is timed (even where
+        # imports don't write bytecode)
+        import py_compile
+        py_compile.compile(ek.__file__.replace('.pyc', '.py'), doraise=True)
+    def test_import_time(self):
+        import os
+        import subprocess
+        import sys
+        code = "import sys, time; sys.path.insert(0, %r); start = time.time(); import ek; print time.time() - start; print ' '.join(m for m in ('nevow', 'twisted', 'PIL') if m in sys.modules)" % (os.path.dirname(os.path.abspath(ek.__file__)),)
+        times = []
+        for i in xrange(3): # best of three
+            out = subprocess.check_output([sys.executable, '-c', code]).split('\n')
+            self.assertEqual(out[1], '', "importing ek loaded %s" % (out[1],))
+            times.append(float(out[0]))
+        self.assertLess(min(times), self.budget, "importing ek took %.1fms" % (min(times) * 1000,))
+
+if __name__ == '__main__':
+    unittest.main()